@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
+
+
+# Logical CPU devices are fixed when TensorFlow starts, so every replica count trains in a fresh interpreter
+TRAIN = """
+import json, sys
+from benchmark_suite import synthetic_corpus
+from llm_with_saving import SimpleLLM
+config = json.loads(sys.argv[1])
+data = synthetic_corpus(config['lines'], config['vocab_size'])
+llm = SimpleLLM("scaling")
+llm.train_with_checkpoints(data, epochs=config['epochs'], resume_training=False, streaming=True,
+                           window_size=config['window_size'], batch_size=config['batch_size'],
+                           num_sampled=config['num_sampled'], data_parallel=config['replicas'],
+                           metrics_log=config['metrics_log'], seed=0)
+"""
+
+
+def train_replicas(replicas, config, workdir):
+    """Per-epoch run log records of one training run on the given number of replicas"""
+    metrics_log = os.path.join(workdir, f"replicas_{replicas}.jsonl")
+    config = dict(config, replicas=replicas, metrics_log=metrics_log)
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3",
+               PYTHONPATH=os.pathsep.join(filter(None, [repo_dir, os.environ.get('PYTHONPATH')])))
+    subprocess.run([sys.executable, "-c", TRAIN, json.dumps(config)], cwd=workdir, env=env,
+                   capture_output=True, text=True, check=True)
+    with open(metrics_log) as f:
+        return [record for record in map(json.loads, f) if record['event'] == 'epoch']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-parallel training throughput for 1 to N CPU replicas")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--vocab-size", type=int, default=2000)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=64, help="Per-replica batch size")
+    parser.add_argument("--window-size", type=int, default=50)
+    parser.add_argument("--num-sampled", type=int, default=None, help="Train with sampled softmax")
+    parser.add_argument("--output", default=None, help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    config = {'lines': args.lines, 'vocab_size': args.vocab_size, 'epochs': args.epochs,
+              'batch_size': args.batch_size, 'window_size': args.window_size, 'num_sampled': args.num_sampled}
+    workdir = tempfile.mkdtemp(prefix="llm_scaling_")
+    results = {}
+    print(f"{'replicas':>8} {'global batch':>12} {'samples/s':>10} {'speedup':>8} {'efficiency':>10} {'final loss':>10}")
+    try:
+        for replicas in args.replicas:
+            epochs = train_replicas(replicas, config, workdir)
+            # The first epoch includes graph tracing, so it is left out of the throughput
+            steady = epochs[1:] or epochs
+            samples_per_s = float(np.median([epoch['samples_per_s'] for epoch in steady]))
+            baseline = results[args.replicas[0]]['samples_per_s'] if results else samples_per_s
+            results[replicas] = {
+                'global_batch_size': args.batch_size * replicas,
+                'samples_per_s': samples_per_s,
+                'speedup': samples_per_s / baseline,
+                'efficiency': samples_per_s / baseline * args.replicas[0] / replicas,
+                'final_loss': epochs[-1].get('loss'),
+            }
+            row = results[replicas]
+            print(f"{replicas:>8} {row['global_batch_size']:>12} {samples_per_s:>10.0f} {row['speedup']:>8.2f} "
+                  f"{row['efficiency']:>10.0%} {row['final_loss'] or 0:>10.4f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        report = {
+            'config': vars(args),
+            'environment': {'python': platform.python_version(), 'cpus': os.cpu_count(), 'machine': platform.machine()},
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import time
+import numpy as np
+from tensorflow.keras.preprocessing.sequence import pad_sequences
+from llm_with_saving import SimpleLLM
+from prefix_cache import PrefixCache
+
+
+def windowed_predict(llm, token_ids, next_words):
+    """Original generation loop: re-pad and predict over the whole window for every word"""
+    token_ids = list(token_ids)
+    timings = []
+    for _ in range(next_words):
+        start = time.perf_counter()
+        window = pad_sequences([token_ids], maxlen=llm.max_sequence_length-1, padding='pre')
+        predicted_probabilities = llm.model.predict(window, verbose=0)[0]
+        token_ids.append(int(np.argmax(predicted_probabilities)))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def stateful_engine(llm, token_ids, next_words):
+    """Engine loop: encode the prompt once, then one LSTM step per word"""
+    engine = llm.get_engine()
+    window = pad_sequences([token_ids], maxlen=llm.max_sequence_length-1, padding='pre')
+    predicted_probabilities, states = engine.encode(window)
+    timings = []
+    for _ in range(next_words):
+        start = time.perf_counter()
+        predicted_index = int(np.argmax(predicted_probabilities[0]))
+        predicted_probabilities, states = engine.step([predicted_index], states)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def agreement(llm, prompts, next_words):
+    """Share of greedy words where the stateful engine matches exact windowed decoding, position by position"""
+    engine = llm.get_engine()
+    window = pad_sequences(prompts, maxlen=llm.max_sequence_length-1, padding='pre')
+    stateful = engine.generate_batch(window, next_words=next_words, exact=False)
+    exact = engine.generate_batch(window, next_words=next_words)
+    matches = [a == b for fast, slow in zip(stateful, exact) for a, b in zip(fast, slow)]
+    return sum(matches) / max(len(matches), 1)
+
+
+def batch_throughput(llm, batch_size, next_words, **decoding):
+    """Tokens per second for generate_batch on batch_size random prompts"""
+    engine = llm.get_engine()
+    rng = np.random.default_rng(batch_size)
+    prompts = rng.integers(1, llm.total_words, size=(batch_size, llm.max_sequence_length-1))
+    start = time.perf_counter()
+    generated = engine.generate_batch(prompts, next_words=next_words, **decoding)
+    elapsed = time.perf_counter() - start
+    return sum(len(ids) for ids in generated) / elapsed
+
+
+def prompt_encoding(llm, prompts, prefix_cache=None):
+    """Seconds to encode a block of padded prompts, with or without a prefix cache"""
+    engine = llm.get_engine()
+    engine.prefix_cache = prefix_cache
+    window = pad_sequences(prompts, maxlen=llm.max_sequence_length-1, padding='pre')
+    start = time.perf_counter()
+    engine.encode_prompts(window)
+    elapsed = time.perf_counter() - start
+    engine.prefix_cache = None
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generation latency and batch throughput benchmark")
+    parser.add_argument("--model-name", default=None, help="Checkpointed model to load (default: random weights)")
+    parser.add_argument("--vocab-size", type=int, default=5000)
+    parser.add_argument("--window", type=int, default=50)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--num-beams", type=int, default=1)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--prefix-prompts", type=int, default=32,
+                        help="Templated prompts for the prefix cache comparison")
+    args = parser.parse_args()
+
+    llm = SimpleLLM(args.model_name or "benchmark")
+    if args.model_name is None or not llm.load_checkpoint():
+        llm.total_words = args.vocab_size
+        llm.max_sequence_length = args.window + 1
+        llm.build_model()
+
+    rng = np.random.default_rng(0)
+    prompt = rng.integers(1, llm.total_words, size=8).tolist()
+
+    # Warm up both paths so tracing is not counted
+    windowed_predict(llm, prompt, 2)
+    stateful_engine(llm, prompt, 2)
+
+    print(f"{'words':>6} {'mode':>10} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'last ms':>8}")
+    for next_words in args.lengths:
+        for mode, run in (("predict", windowed_predict), ("stateful", stateful_engine)):
+            timings = np.array(run(llm, prompt, next_words)) * 1000
+            # Per-token time over the final quarter shows whether cost grows with length
+            tail = timings[-max(1, next_words // 4):].mean()
+            print(f"{next_words:>6} {mode:>10} {timings.mean():>9.3f} {np.percentile(timings, 50):>8.3f} "
+                  f"{np.percentile(timings, 95):>8.3f} {tail:>8.3f}")
+
+    # Stateful decoding runs past the training window, so its text drifts from the windowed original
+    prompts = [rng.integers(1, llm.total_words, size=int(length)).tolist()
+               for length in rng.integers(2, llm.max_sequence_length, size=16)]
+    for next_words in args.lengths:
+        print(f"{next_words:>6} words: stateful matches exact windowed decoding on "
+              f"{agreement(llm, prompts, next_words):.0%} of greedy words")
+
+    # Batched decoding: tokens/sec should scale with batch size
+    decoding = {"num_beams": args.num_beams, "temperature": args.temperature}
+    batch_throughput(llm, 2, 2, **decoding)
+    print(f"\n{'batch':>6} {'tokens/s':>10} {'speedup':>8}")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        throughput = batch_throughput(llm, batch_size, 32, **decoding)
+        baseline = baseline or throughput
+        print(f"{batch_size:>6} {throughput:>10.1f} {throughput / baseline:>8.2f}")
+
+    # Templated traffic: prompts share a long opening and differ in their last words. Pre-padding
+    # is part of every prefix, so continuations of mixed lengths share only within each length
+    opening = rng.integers(1, llm.total_words, size=llm.max_sequence_length - 6).tolist()
+    cases = {
+        'same': [opening + [int(word)] for word in rng.integers(1, llm.total_words, size=args.prefix_prompts + 1)],
+        'mixed': [opening + rng.integers(1, llm.total_words, size=int(words)).tolist()
+                  for words in rng.integers(1, 5, size=args.prefix_prompts + 1)],
+    }
+    print(f"\n{'lengths':>7} {'prompts':>7} {'uncached ms':>12} {'cached ms':>10} {'speedup':>8} {'reused':>7}")
+    for name, prompts in cases.items():
+        cache = PrefixCache()
+        # The first prompt traces the graph and leaves the shared opening in the cache
+        prompt_encoding(llm, prompts[:1], cache)
+        cache.stats = dict.fromkeys(cache.stats, 0)
+        uncached = prompt_encoding(llm, prompts[1:])
+        cached = prompt_encoding(llm, prompts[1:], cache)
+        usage = cache.usage()
+        print(f"{name:>7} {len(prompts) - 1:>7} {uncached * 1000:>12.3f} {cached * 1000:>10.3f} "
+              f"{uncached / cached:>8.2f} "
+              f"{usage['reused_tokens'] / max(usage['reused_tokens'] + usage['encoded_tokens'], 1):>7.0%}")
+
+if __name__ == "__main__":
+    main()
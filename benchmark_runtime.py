@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+
+# Each runtime is measured in a fresh interpreter so imports and RSS start cold
+COLD_START = """
+import json, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "tensorflow":
+    from llm_with_saving import SimpleLLM as LLM
+else:
+    from numpy_runtime import NumpyLLM as LLM
+imported = time.perf_counter()
+llm = LLM(sys.argv[2])
+llm.load_checkpoint()
+loaded = time.perf_counter()
+llm.generate_text(sys.argv[3], next_words=1)
+first_token = time.perf_counter()
+# VmHWM is the peak RSS of this image; ru_maxrss would carry over the parent's peak across exec
+with open("/proc/self/status") as f:
+    peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM"))
+print(json.dumps({
+    "import_s": imported - start,
+    "load_s": loaded - imported,
+    "first_token_s": first_token - start,
+    "max_rss_mb": peak_kb / 1024,
+}))
+"""
+
+
+def cold_start(runtime, model_name, prompt):
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", COLD_START, runtime, model_name, prompt],
+                            capture_output=True, text=True, env=env, check=True)
+    wall = time.perf_counter() - start
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    stats["process_wall_s"] = wall
+    return stats
+
+
+def check_outputs(model_name, samples, tolerance):
+    """Compare next-word probabilities of both runtimes on random prompts"""
+    from llm_with_saving import SimpleLLM
+    from numpy_runtime import NumpyLLM
+
+    keras_llm = SimpleLLM(model_name)
+    numpy_llm = NumpyLLM(model_name)
+    keras_llm.load_checkpoint()
+    numpy_llm.load_checkpoint()
+
+    rng = np.random.default_rng(0)
+    token_ids = rng.integers(0, numpy_llm.total_words, size=(samples, numpy_llm.max_sequence_length - 1))
+    expected = keras_llm.model.predict(token_ids, verbose=0)
+    actual, _ = numpy_llm.engine.encode(token_ids)
+    difference = float(np.abs(expected - actual).max())
+    return {"max_abs_diff": difference, "within_tolerance": difference <= tolerance}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start and accuracy comparison of the TensorFlow and NumPy runtimes")
+    parser.add_argument("--model-name", default="fairy_tale_model")
+    parser.add_argument("--prompt", default="Once upon a time")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--samples", type=int, default=64, help="Random prompts used for the output check")
+    parser.add_argument("--tolerance", type=float, default=1e-4)
+    args = parser.parse_args()
+    report = {}
+
+    print(f"{'runtime':>11} {'import s':>9} {'load s':>8} {'1st tok s':>10} {'wall s':>8} {'RSS MB':>8}")
+    for runtime in ("tensorflow", "numpy"):
+        runs = [cold_start(runtime, args.model_name, args.prompt) for _ in range(args.repeats)]
+        # Median of the repeats keeps one slow disk read from skewing the comparison
+        stats = {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+        report[runtime] = stats
+        print(f"{runtime:>11} {stats['import_s']:>9.3f} {stats['load_s']:>8.3f} {stats['first_token_s']:>10.3f} "
+              f"{stats['process_wall_s']:>8.3f} {stats['max_rss_mb']:>8.1f}")
+
+    # Imported last so the cold-start children are not forked from a TensorFlow-sized parent
+    report["check"] = check_outputs(args.model_name, args.samples, args.tolerance)
+    print(f"Max |keras - numpy| probability: {report['check']['max_abs_diff']:.2e}")
+    if not report["check"]["within_tolerance"]:
+        raise SystemExit(f"NumPy runtime differs from Keras by more than {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
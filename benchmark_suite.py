@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+from benchmark_generation import stateful_engine
+from benchmark_runtime import cold_start
+from checkpoint_manager import CheckpointManager
+from llm_with_saving import SimpleLLM, SampledSoftmaxSequential
+
+
+# Whether a larger value of each metric is better, for the regression check
+HIGHER_IS_BETTER = {
+    'prepare_data_s': False,
+    'prepare_data_cached_s': False,
+    'prepare_data_peak_mb': False,
+    'prepare_dataset_s': False,
+    'train_samples_per_s': True,
+    'train_epoch_s': False,
+    'segment_targets_per_s': True,
+    'checkpoint_blocking_s': False,
+    'checkpoint_write_s': False,
+    'checkpoint_restore_s': False,
+    'h5_save_s': False,
+    'h5_load_s': False,
+    'cold_start_load_s': False,
+    'cold_start_first_token_s': False,
+    'cold_start_rss_mb': False,
+    'token_latency_p50_ms': False,
+    'token_latency_p95_ms': False,
+    'token_latency_p99_ms': False,
+    'generate_text_ms_per_token': False,
+}
+
+
+def synthetic_corpus(lines, vocab_size, min_words=4, max_words=20, seed=0):
+    """Lines of Zipf-distributed words w1..w<vocab_size>, roughly the shape of natural text"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(min_words, max_words + 1, size=lines)
+    ids = np.minimum(rng.zipf(1.2, size=lengths.sum()), vocab_size)
+    words = np.char.add('w', ids.astype(str))
+    return [' '.join(line) for line in np.split(words, np.cumsum(lengths)[:-1])]
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Wall time of every epoch"""
+
+    def __init__(self):
+        super().__init__()
+        self.epoch_seconds = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_seconds.append(time.perf_counter() - self.start)
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def measure_data_prep(llm, data, window_size, batch_size):
+    results = {}
+    cache_dir = f"checkpoints/{llm.model_name}/token_cache"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    sequences, results['prepare_data_s'] = timed(llm.prepare_data, data)
+    _, results['prepare_data_cached_s'] = timed(llm.prepare_data, data)
+
+    # Traced separately: tracemalloc slows the allocations it counts
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    tracemalloc.start()
+    llm.prepare_data(data)
+    results['prepare_data_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    _, results['prepare_dataset_s'] = timed(llm.prepare_dataset, data, window_size=window_size, batch_size=batch_size)
+    return results, len(sequences)
+
+
+def measure_training(llm, data, num_samples, epochs, batch_size, streaming, window_size):
+    timer = EpochTimer()
+    llm.train_with_checkpoints(data, epochs=epochs, checkpoint_freq=1, resume_training=False,
+                               streaming=streaming, window_size=window_size, batch_size=batch_size,
+                               callbacks=[timer])
+    # The first epoch includes graph tracing, so it is reported but not averaged
+    steady = timer.epoch_seconds[1:] or timer.epoch_seconds
+    return {
+        'train_epoch_s': float(np.median(steady)),
+        'train_samples_per_s': num_samples / float(np.median(steady)),
+        'train_first_epoch_s': timer.epoch_seconds[0],
+    }
+
+
+def measure_segment_training(data, epochs, batch_size, segment_length, window_size):
+    """Target tokens per second of truncated-BPTT training, every token of a line being a target"""
+    llm = SimpleLLM("benchmark_segments")
+    timer = EpochTimer()
+    llm.train_with_checkpoints(data, epochs=epochs, checkpoint_freq=1, resume_training=False,
+                               window_size=window_size, batch_size=batch_size, segment_length=segment_length,
+                               callbacks=[timer])
+    num_targets = len(llm.tokenize_corpus(data, reuse_tokenizer=True)[0])
+    steady = timer.epoch_seconds[1:] or timer.epoch_seconds
+    return {'segment_targets_per_s': num_targets / float(np.median(steady))}
+
+
+def measure_checkpoints(llm, repeats):
+    results = {'checkpoint_blocking_s': [], 'checkpoint_write_s': [], 'checkpoint_restore_s': [],
+               'h5_save_s': [], 'h5_load_s': []}
+    checkpoint_dir = f"checkpoints/{llm.model_name}/bench"
+    manager = CheckpointManager(checkpoint_dir, keep_last=1)
+    path = f"{checkpoint_dir}/model.h5"
+    for i in range(repeats):
+        start = time.perf_counter()
+        entry = manager.save(llm.model, epoch=i, step=i)
+        results['checkpoint_blocking_s'].append(time.perf_counter() - start)
+        manager.wait()
+        results['checkpoint_write_s'].append(time.perf_counter() - start)
+        _, seconds = timed(manager.restore, llm.model, manager.find(file=entry['file']))
+        results['checkpoint_restore_s'].append(seconds)
+
+        _, seconds = timed(llm.model.save, path)
+        results['h5_save_s'].append(seconds)
+        _, seconds = timed(load_model, path, custom_objects={'SampledSoftmaxSequential': SampledSoftmaxSequential})
+        results['h5_load_s'].append(seconds)
+    shutil.rmtree(checkpoint_dir)
+    return {key: float(np.median(values)) for key, values in results.items()}
+
+
+def measure_cold_start(model_name, prompt, repeats):
+    runs = [cold_start("tensorflow", model_name, prompt) for _ in range(repeats)]
+    return {
+        'cold_start_load_s': float(np.median([run['load_s'] for run in runs])),
+        'cold_start_first_token_s': float(np.median([run['first_token_s'] for run in runs])),
+        'cold_start_rss_mb': float(np.median([run['max_rss_mb'] for run in runs])),
+    }
+
+
+def measure_generation(llm, data, next_words, prompts):
+    rng = np.random.default_rng(0)
+    seeds = [' '.join(data[i].split()[:3]) for i in rng.integers(0, len(data), size=prompts)]
+    llm.generate_text(seeds[0], next_words=2)
+
+    timings = []
+    for seed_text in seeds:
+        token_ids = llm.tokenizer.texts_to_sequences([seed_text])[0]
+        timings += stateful_engine(llm, token_ids, next_words)
+    timings = np.array(timings) * 1000
+
+    _, seconds = timed(lambda: [llm.generate_text(seed_text, next_words=next_words) for seed_text in seeds])
+    return {
+        'token_latency_p50_ms': float(np.percentile(timings, 50)),
+        'token_latency_p95_ms': float(np.percentile(timings, 95)),
+        'token_latency_p99_ms': float(np.percentile(timings, 99)),
+        'generate_text_ms_per_token': seconds * 1000 / (len(seeds) * next_words),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Metrics that moved the wrong way by more than tolerance, relative to the baseline"""
+    regressions = []
+    for name, higher_is_better in HIGHER_IS_BETTER.items():
+        current, previous = results.get(name), baseline.get(name)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({'metric': name, 'baseline': previous, 'current': current, 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleLLM performance suite on a synthetic corpus")
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--vocab-size", type=int, default=2000)
+    parser.add_argument("--max-words", type=int, default=20, help="Longest synthetic line, in words")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--streaming", action="store_true", help="Train on streamed windows instead of padded prefixes")
+    parser.add_argument("--window-size", type=int, default=50)
+    parser.add_argument("--segment-length", type=int, default=64, help="Segment length for the truncated-BPTT run")
+    parser.add_argument("--repeats", type=int, default=3, help="Repeats for checkpoint and cold-start timings")
+    parser.add_argument("--next-words", type=int, default=32)
+    parser.add_argument("--prompts", type=int, default=8)
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown per metric")
+    args = parser.parse_args()
+
+    data = synthetic_corpus(args.lines, args.vocab_size, max_words=args.max_words)
+    output = os.path.abspath(args.output) if args.output else None
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    # Checkpoints and caches go to a scratch directory; cold-start children still import from the repo
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [repo_dir, os.environ.get('PYTHONPATH')]))
+    workdir = tempfile.mkdtemp(prefix="llm_bench_")
+    os.chdir(workdir)
+
+    try:
+        llm = SimpleLLM("benchmark")
+        results, num_samples = measure_data_prep(llm, data, args.window_size, args.batch_size)
+        results.update(measure_training(llm, data, num_samples, args.epochs, args.batch_size,
+                                        args.streaming, args.window_size))
+        results.update(measure_segment_training(data, args.epochs, args.batch_size, args.segment_length,
+                                                args.window_size))
+        results.update(measure_checkpoints(llm, args.repeats))
+        results.update(measure_cold_start(llm.model_name, data[0], args.repeats))
+        results.update(measure_generation(llm, data, args.next_words, args.prompts))
+    finally:
+        os.chdir(repo_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'config': dict(vars(args), samples=num_samples, total_words=llm.total_words,
+                       max_sequence_length=llm.max_sequence_length),
+        'environment': {'python': platform.python_version(), 'tensorflow': tf.__version__,
+                        'numpy': np.__version__, 'cpus': os.cpu_count(), 'machine': platform.machine()},
+        'results': results,
+    }
+
+    print(f"\n{'metric':<28} {'value':>12}")
+    for name, value in results.items():
+        print(f"{name:<28} {value:>12.4f}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        report['regressions'] = compare(results, baseline, args.tolerance)
+        for regression in report['regressions']:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.4f} -> "
+                  f"{regression['current']:.4f} ({regression['change']:+.1%})")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+
+    if report.get('regressions'):
+        raise SystemExit(f"{len(report['regressions'])} metric(s) regressed by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+
+def optimizer_variables(optimizer):
+    variables = optimizer.variables
+    return variables() if callable(variables) else variables
+
+
+class CheckpointManager:
+    """Weights-and-optimizer snapshots written on a background thread, with a manifest and retention"""
+
+    def __init__(self, checkpoint_dir, keep_last=3, max_pending=2):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self.manifest_path = os.path.join(checkpoint_dir, "manifest.json")
+        manifest = self.read_manifest()
+        best = self.find(file=manifest.get('best'))
+        self.best_loss = best['loss'] if best else None
+        self.io_seconds = 0.0
+        # A bounded queue caps snapshot memory if the disk falls behind training
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._writer = None
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'checkpoints': [], 'best': None, 'latest': None}
+
+    def find(self, file=None, epoch=None):
+        """Manifest entry by file name, or the newest entry for a given epoch"""
+        matches = [entry for entry in self.read_manifest()['checkpoints']
+                   if (file is None or entry['file'] == file) and (epoch is None or entry['epoch'] == epoch)]
+        return matches[-1] if matches and (file or epoch is not None) else None
+
+    def latest(self):
+        return self.find(file=self.read_manifest()['latest'])
+
+    def best(self):
+        return self.find(file=self.read_manifest()['best'])
+
+    def save(self, model, epoch, step, loss=None):
+        """Snapshot weights and optimizer state now; the file is written in the background"""
+        self._raise_writer_error()
+        weights = model.get_weights()
+        optimizer = [np.array(variable) for variable in optimizer_variables(model.optimizer)] if model.optimizer else []
+        is_best = loss is not None and (self.best_loss is None or loss < self.best_loss)
+        if is_best:
+            self.best_loss = loss
+        entry = {
+            'file': f"ckpt_epoch_{epoch:03d}_step_{step:07d}.npz",
+            'epoch': epoch,
+            'step': step,
+            'loss': None if loss is None else float(loss),
+            'is_best': is_best,
+            'time': time.time(),
+            # Layer classes, configs and weight counts, so a snapshot loads without the model code
+            'layers': [[type(layer).__name__, layer.get_config(), len(layer.weights)] for layer in model.layers],
+        }
+
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        start = time.perf_counter()
+        self._pending.put((weights, optimizer, entry))
+        self.io_seconds += time.perf_counter() - start
+        return entry
+
+    def wait(self):
+        """Block until every queued snapshot is on disk"""
+        start = time.perf_counter()
+        self._pending.join()
+        self.io_seconds += time.perf_counter() - start
+        self._raise_writer_error()
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Checkpoint write failed: {error}") from error
+
+    def _write_loop(self):
+        while True:
+            weights, optimizer, entry = self._pending.get()
+            try:
+                self._write(weights, optimizer, entry)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._pending.task_done()
+
+    def _write(self, weights, optimizer, entry):
+        arrays = {f"weight_{i}": w for i, w in enumerate(weights)}
+        arrays.update({f"optimizer_{i}": v for i, v in enumerate(optimizer)})
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        data = buffer.getvalue()
+        entry = dict(entry, sha256=hashlib.sha256(data).hexdigest())
+
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        path = os.path.join(self.checkpoint_dir, entry['file'])
+        write_atomic(path, data)
+
+        manifest = self.read_manifest()
+        manifest['checkpoints'] = [e for e in manifest['checkpoints'] if e['file'] != entry['file']] + [entry]
+        manifest['latest'] = entry['file']
+        if entry.pop('is_best'):
+            manifest['best'] = entry['file']
+
+        # Retention: the newest keep_last snapshots plus the best one
+        keep = {e['file'] for e in manifest['checkpoints'][-self.keep_last:]} | {manifest['best']}
+        removed = [e for e in manifest['checkpoints'] if e['file'] not in keep]
+        manifest['checkpoints'] = [e for e in manifest['checkpoints'] if e['file'] in keep]
+        write_atomic(self.manifest_path, json.dumps(manifest, indent=2).encode())
+        for e in removed:
+            try:
+                os.remove(os.path.join(self.checkpoint_dir, e['file']))
+            except FileNotFoundError:
+                pass
+
+    def load_arrays(self, entry):
+        """Read a snapshot, verifying it against the manifest hash"""
+        with open(os.path.join(self.checkpoint_dir, entry['file']), 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != entry['sha256']:
+            raise ValueError(f"Checkpoint {entry['file']} does not match its manifest hash")
+        with np.load(io.BytesIO(data)) as saved:
+            weights = [saved[f"weight_{i}"] for i in range(sum(k.startswith('weight_') for k in saved.files))]
+            optimizer = [saved[f"optimizer_{i}"] for i in range(sum(k.startswith('optimizer_') for k in saved.files))]
+        return weights, optimizer
+
+    def restore(self, model, entry=None):
+        """Load weights and optimizer state from a manifest entry (default: latest); returns the entry"""
+        entry = entry or self.latest()
+        if entry is None:
+            return None
+        weights, optimizer = self.load_arrays(entry)
+        model.set_weights(weights)
+
+        if optimizer and model.optimizer is not None:
+            if not getattr(model.optimizer, 'built', False):
+                model.optimizer.build(model.trainable_variables)
+            variables = optimizer_variables(model.optimizer)
+            if len(variables) == len(optimizer):
+                for variable, value in zip(variables, optimizer):
+                    variable.assign(value)
+            else:
+                print(f"Optimizer state in {entry['file']} does not match the model, starting a fresh optimizer")
+        return entry
+
+
+def choose_checkpoint(checkpoint_dir, epoch=None):
+    """The checkpoint to load: (manifest entry, None) for a snapshot, (None, path) for an .h5 file
+
+    Snapshots take precedence: the one for epoch, else the best (or latest) one. Without
+    snapshots it falls back to model_epoch_NNN.h5, or best_model.h5, final_model.h5 and the
+    newest epoch file. Returns (None, None) when there is nothing to load.
+    """
+    manager = CheckpointManager(checkpoint_dir)
+    entry = manager.find(epoch=epoch) if epoch is not None else manager.best() or manager.latest()
+    if entry is not None:
+        return entry, None
+    if epoch is not None:
+        return None, os.path.join(checkpoint_dir, f"model_epoch_{epoch:03d}.h5")
+    for name in ("best_model.h5", "final_model.h5"):
+        if os.path.exists(os.path.join(checkpoint_dir, name)):
+            return None, os.path.join(checkpoint_dir, name)
+    checkpoints = [f for f in os.listdir(checkpoint_dir) if f.startswith('model_epoch_')]
+    if not checkpoints:
+        return None, None
+    latest = max(checkpoints, key=lambda x: int(x.split('_')[2].split('.')[0]))
+    return None, os.path.join(checkpoint_dir, latest)
+
+
+def write_atomic(path, data):
+    """Write to a temporary file and rename, so readers never see a partial file"""
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
@@ -0,0 +1,256 @@
+import argparse
+import bz2
+import glob
+import gzip
+import json
+import lzma
+import os
+import time
+from collections import Counter, deque
+from multiprocessing import Pool
+import numpy as np
+from checkpoint_manager import write_atomic
+from fast_tokenizer import CompactTokenizer, _count_chunk, _encode_chunk, _init_worker
+
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+TEXT_SUFFIXES = ('.txt', '.text', '.md')
+
+
+def is_text_file(path):
+    base, suffix = os.path.splitext(path)
+    if suffix in OPENERS:
+        suffix = os.path.splitext(base)[1]
+    return suffix in TEXT_SUFFIXES
+
+
+def expand_sources(sources):
+    """File paths, globs and directories (searched recursively for text files) as a sorted file list"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths += [os.path.join(root, name) for name in files if is_text_file(name)]
+        else:
+            matches = [path for path in glob.glob(source, recursive=True) if os.path.isfile(path)]
+            if not matches:
+                raise FileNotFoundError(f"No files match {source}")
+            paths += matches
+    return sorted(set(paths))
+
+
+def open_text(path):
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, 'rt', encoding='utf-8', errors='replace')
+
+
+def iter_chunks(paths, chunk_lines=10000):
+    """Non-empty lines of every file, streamed in lists of chunk_lines"""
+    chunk = []
+    for path in paths:
+        with open_text(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    chunk.append(line)
+                    if len(chunk) == chunk_lines:
+                        yield chunk
+                        chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_chunks(tokenizer, worker, chunks, processes, max_pending=None):
+    """worker(chunk) for every chunk, in order, in processes that each hold a copy of tokenizer"""
+    initargs = (tokenizer.get_config(), tokenizer.blob, tokenizer.offsets)
+    if processes <= 1:
+        _init_worker(*initargs)
+        yield from map(worker, chunks)
+        return
+
+    with Pool(processes, initializer=_init_worker, initargs=initargs) as pool:
+        # A bounded window of chunks in flight keeps memory flat whatever the corpus size
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(worker, (chunk,)))
+            if len(pending) >= (max_pending or 2 * processes):
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class ShardWriter:
+    """Collects encoded lines and writes them as shards of at most shard_tokens ids, never splitting a line"""
+
+    def __init__(self, output_dir, shard_tokens):
+        self.output_dir = output_dir
+        self.shard_tokens = shard_tokens
+        self.shards = []
+        self.tokens, self.lengths, self.buffered = [], [], 0
+
+    def add(self, tokens, lengths):
+        self.tokens.append(tokens)
+        self.lengths.append(lengths)
+        self.buffered += len(tokens)
+        if self.buffered < self.shard_tokens:
+            return
+
+        tokens, lengths = np.concatenate(self.tokens), np.concatenate(self.lengths)
+        while len(tokens) >= self.shard_tokens:
+            ends = np.cumsum(lengths)
+            # Whole lines up to the size limit; a single over-long line gets a shard of its own
+            lines = max(1, int(np.searchsorted(ends, self.shard_tokens, side='right')))
+            self.write(tokens[:ends[lines - 1]], lengths[:lines])
+            tokens, lengths = tokens[ends[lines - 1]:], lengths[lines:]
+        self.tokens, self.lengths, self.buffered = [tokens], [lengths], len(tokens)
+
+    def close(self):
+        if self.buffered:
+            self.write(np.concatenate(self.tokens), np.concatenate(self.lengths))
+        self.tokens, self.lengths, self.buffered = [], [], 0
+        return self.shards
+
+    def write(self, tokens, lengths):
+        # Lines whose words were all unknown carry no samples
+        lengths = lengths[lengths > 0]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        name = f"shard_{len(self.shards):05d}"
+        for suffix, array in (('tokens', tokens.astype(np.int32)), ('offsets', offsets)):
+            path = os.path.join(self.output_dir, f"{name}.{suffix}.npy")
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(path + '.tmp', path)
+        self.shards.append({
+            'name': name,
+            'num_tokens': int(len(tokens)),
+            'num_lines': int(len(lengths)),
+            # Every token except the first of its line is a next-word target
+            'samples': int(len(tokens) - len(lengths)),
+        })
+
+
+def ingest(sources, output_dir, processes=None, chunk_lines=10000, shard_tokens=2**22, num_words=None,
+           tokenizer=None):
+    """Tokenize text files into shards under output_dir and return the ShardedCorpus
+
+    Files are streamed in chunks of lines: one pass counts words to fit the vocabulary
+    (skipped when a fitted tokenizer is given), a second encodes them. Both passes run
+    on worker processes, so memory is bounded by the vocabulary and one shard.
+    """
+    paths = expand_sources(sources)
+    if not paths:
+        raise FileNotFoundError(f"No text files found in {sources}")
+    processes = processes or os.cpu_count()
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+
+    if tokenizer is None:
+        tokenizer = CompactTokenizer(num_words=num_words)
+        # Merging the chunk counts in order keeps first-appearance tie-breaking, as fit_on_texts does
+        word_counts = Counter()
+        for counts in map_chunks(tokenizer, _count_chunk, iter_chunks(paths, chunk_lines), processes):
+            word_counts.update(counts)
+        tokenizer.fit_on_counts(word_counts)
+        print(f"Vocabulary of {len(tokenizer.counts)} words from {len(paths)} files "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    writer = ShardWriter(output_dir, shard_tokens)
+    for tokens, lengths in map_chunks(tokenizer, _encode_chunk, iter_chunks(paths, chunk_lines), processes):
+        writer.add(tokens, lengths)
+    shards = writer.close()
+
+    tokenizer.save(os.path.join(output_dir, "tokenizer.npz"))
+    manifest = {
+        'sources': paths,
+        'tokenizer': tokenizer.fingerprint(),
+        'shard_tokens': shard_tokens,
+        'num_tokens': sum(shard['num_tokens'] for shard in shards),
+        'samples': sum(shard['samples'] for shard in shards),
+        'shards': shards,
+    }
+    write_atomic(os.path.join(output_dir, "corpus.json"), json.dumps(manifest, indent=2).encode())
+    print(f"Wrote {manifest['num_tokens']} tokens in {len(shards)} shards to {output_dir} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return ShardedCorpus(output_dir)
+
+
+class ShardedCorpus:
+    """A corpus written by ingest(): its tokenizer plus memory-mapped token shards"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "corpus.json")) as f:
+            self.manifest = json.load(f)
+        self.shards = self.manifest['shards']
+        self.num_samples = self.manifest['samples']
+        self.tokenizer = CompactTokenizer.load(os.path.join(directory, "tokenizer.npz"))
+        if self.tokenizer.fingerprint() != self.manifest['tokenizer']:
+            raise ValueError(f"Tokenizer in {directory} does not match its shards")
+
+    def load_shard(self, index):
+        name = os.path.join(self.directory, self.shards[index]['name'])
+        return np.load(f"{name}.tokens.npy", mmap_mode='r'), np.load(f"{name}.offsets.npy", mmap_mode='r')
+
+    def num_batches(self, batch_size):
+        return sum(-(-shard['samples'] // batch_size) for shard in self.shards if shard['samples'])
+
+    def num_window_tokens(self, window_size):
+        """Input tokens over every window of an epoch, without the zeros before line starts"""
+        return sum(count_window_tokens(self.load_shard(index)[1], window_size) for index in range(len(self.shards)))
+
+    def iter_batches(self, window_size, batch_size, rng=None):
+        """(windows, targets) batches: shards in random order, samples shuffled within each shard"""
+        rng = rng or np.random.default_rng()
+        for index in rng.permutation(len(self.shards)):
+            yield from window_batches(*self.load_shard(index), window_size, batch_size, rng)
+
+
+def target_positions(offsets):
+    """Position of every token but the first of its line, in corpus order"""
+    offsets = np.asarray(offsets)
+    is_target = np.ones(int(offsets[-1]), dtype=bool)
+    is_target[offsets[:-1][np.diff(offsets) > 0]] = False
+    return np.flatnonzero(is_target)
+
+
+def context_windows(tokens, offsets, positions, window_size):
+    """The window_size ids before each position, zeroed where they fall before the start of its line"""
+    line_starts = np.asarray(offsets)[np.searchsorted(offsets, positions, side='right') - 1]
+    indices = positions[:, None] + np.arange(-window_size, 0)
+    # Fancy indexing reads only the pages of a memory-mapped tokens array that are needed
+    return np.where(indices >= line_starts[:, None], tokens[np.maximum(indices, 0)], 0).astype(np.int32)
+
+
+def window_batches(tokens, offsets, window_size, batch_size, rng):
+    """(windows, targets) batches over every target of one block of lines, in random order"""
+    positions = target_positions(offsets)
+    rng.shuffle(positions)
+    for start in range(0, len(positions), batch_size):
+        batch = positions[start:start + batch_size]
+        yield context_windows(tokens, offsets, batch, window_size), np.asarray(tokens[batch], dtype=np.int32)
+
+
+def count_window_tokens(offsets, window_size):
+    """Input tokens over every window of these lines, without the zeros before line starts"""
+    samples = np.maximum(np.diff(offsets) - 1, 0)
+    # The k-th target of a line reads min(k, window_size) of its words
+    full = np.minimum(samples, window_size)
+    return int((full * (full + 1) // 2 + (samples - full) * window_size).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize text files into training shards")
+    parser.add_argument("sources", nargs="+", help="Files, globs or directories; .gz, .bz2 and .xz are decompressed")
+    parser.add_argument("--output", required=True, help="Directory for the shards, tokenizer and corpus.json")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--chunk-lines", type=int, default=10000)
+    parser.add_argument("--shard-tokens", type=int, default=2**22)
+    parser.add_argument("--num-words", type=int, default=None, help="Keep only the most frequent words")
+    args = parser.parse_args()
+
+    ingest(args.sources, args.output, processes=args.processes, chunk_lines=args.chunk_lines,
+           shard_tokens=args.shard_tokens, num_words=args.num_words)
+
+
+if __name__ == "__main__":
+    main()
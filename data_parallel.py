@@ -0,0 +1,26 @@
+import os
+import tensorflow as tf
+
+
+def configure_cpu_replicas(num_replicas, intra_op_threads=None, inter_op_threads=None):
+    """Split the host CPU into num_replicas logical devices and return a MirroredStrategy over them
+
+    TensorFlow only accepts device and thread settings before it runs its first op, so
+    this must be called before anything else touches TensorFlow in the process.
+    """
+    cores = os.cpu_count() or 1
+    cpu = tf.config.list_physical_devices('CPU')[0]
+    try:
+        tf.config.set_logical_device_configuration(cpu, [tf.config.LogicalDeviceConfiguration()] * num_replicas)
+        # One shared pool of a thread per core for the math inside each op, and enough
+        # op-scheduling threads that every replica's step can be in flight at once
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads or cores)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads or 2 * num_replicas)
+    except RuntimeError:
+        if len(tf.config.list_logical_devices('CPU')) != num_replicas:
+            raise RuntimeError(f"TensorFlow is already initialized with {len(tf.config.list_logical_devices('CPU'))} "
+                               f"CPU device(s); call configure_cpu_replicas({num_replicas}) at program start")
+
+    devices = [device.name for device in tf.config.list_logical_devices('CPU')]
+    # Gradients are summed on one device; NCCL all-reduce is GPU-only
+    return tf.distribute.MirroredStrategy(devices, cross_device_ops=tf.distribute.ReductionToOneDevice())
@@ -0,0 +1,180 @@
+import numpy as np
+
+
+def pad_pre(sequences, length):
+    """NumPy equivalent of pad_sequences(..., padding='pre', truncating='pre')"""
+    padded = np.zeros((len(sequences), length), dtype=np.int32)
+    for row, sequence in enumerate(sequences):
+        sequence = sequence[-length:]
+        if sequence:
+            padded[row, -len(sequence):] = sequence
+    return padded
+
+
+def generate_texts(engine, tokenizer, prompts, window, stop_words=None, **decoding):
+    """Tokenize and pre-pad prompts to the training window, decode them together and append the words"""
+    # Pre-padding to the training window lines up prompts of any length
+    token_ids = pad_pre(tokenizer.texts_to_sequences(prompts), window)
+
+    # A row finishes on an unknown index or on any of the stop words
+    stop_ids = {0}
+    for sequence in tokenizer.texts_to_sequences(stop_words or []):
+        stop_ids.update(sequence)
+
+    generated = engine.generate_batch(token_ids, stop_ids=stop_ids, **decoding)
+    return [
+        seed_text + "".join(" " + tokenizer.index_word[index] for index in predicted)
+        for seed_text, predicted in zip(prompts, generated)
+    ]
+
+
+class BatchDecoder:
+    """Batched decoding loops for any engine exposing encode(token_ids, states) and step(token_ids, states)"""
+
+    # Optional PrefixCache shared by every prompt this engine encodes
+    prefix_cache = None
+
+    def encode_prompts(self, token_ids):
+        """Encode a block of prompts, resuming from cached prefix states when a prefix cache is attached"""
+        if self.prefix_cache is None:
+            return self.encode(token_ids)
+        return self.prefix_cache.encode(self, token_ids)
+
+    def advance(self, next_ids, states, windows=None):
+        """Feed one token per row: a single step on the carried state, or with windows, a re-encode
+        of each row's window shifted by that token; returns probabilities, states and windows"""
+        if windows is None:
+            probabilities, states = self.step(next_ids, states)
+            return probabilities, states, None
+        windows = np.concatenate([windows[:, 1:], np.asarray(next_ids, dtype=np.int32)[:, None]], axis=1)
+        probabilities, states = self.encode(windows)
+        return probabilities, states, windows
+
+    def generate_batch(self, token_ids, next_words=15, temperature=0.0, top_k=None, top_p=None,
+                       num_beams=1, stop_ids=(0,), seed=None, exact=True):
+        """Extend a (batch, length) block of prompts together, returning the generated ids per row
+
+        By default every word re-encodes the last prompt-length tokens from a zero state, the
+        window the model was trained on, in one forward pass per word. exact=False instead keeps
+        growing the context on the carried LSTM state at one step per word; that runs past the
+        training window and changes the output of window-trained models.
+        """
+        token_ids = np.asarray(token_ids, dtype=np.int32)
+        stop_ids = np.asarray(sorted(set(stop_ids) | {0}), dtype=np.int64)
+        windows = token_ids if exact else None
+        if num_beams > 1:
+            return self._beam_search(token_ids, next_words, num_beams, stop_ids, windows)
+
+        rng = np.random.default_rng(seed)
+        batch_size = len(token_ids)
+        output = np.zeros((batch_size, next_words), dtype=np.int64)
+        lengths = np.zeros(batch_size, dtype=np.int64)
+        active = np.arange(batch_size)
+        probabilities, states = self.encode_prompts(token_ids)
+
+        for i in range(next_words):
+            next_ids = sample_next(probabilities, temperature, top_k, top_p, rng)
+            running = ~np.isin(next_ids, stop_ids)
+            active, next_ids = active[running], next_ids[running]
+            output[active, i] = next_ids
+            lengths[active] += 1
+
+            # Finished rows drop out of the batch so they cost nothing further
+            if i == next_words - 1 or not len(active):
+                break
+            states = [state[running] for state in states]
+            windows = None if windows is None else windows[running]
+            probabilities, states, windows = self.advance(next_ids, states, windows)
+
+        return [output[row, :lengths[row]].tolist() for row in range(batch_size)]
+
+    def _beam_search(self, token_ids, next_words, num_beams, stop_ids, windows=None):
+        """Vectorized beam search over every prompt at once; id 0 marks a finished beam"""
+        batch_size = len(token_ids)
+        probabilities, states = self.encode_prompts(token_ids)
+        vocab_size = probabilities.shape[1]
+
+        # Each prompt owns num_beams consecutive rows; only its first beam starts live
+        probabilities = np.repeat(probabilities, num_beams, axis=0)
+        states = [np.repeat(state, num_beams, axis=0) for state in states]
+        if windows is not None:
+            windows = np.repeat(windows, num_beams, axis=0)
+        scores = np.tile([0.0] + [-np.inf] * (num_beams - 1), batch_size)
+        sequences = np.zeros((batch_size * num_beams, 0), dtype=np.int64)
+        finished = np.zeros(batch_size * num_beams, dtype=bool)
+        prompts = np.arange(batch_size)
+        results = [[] for _ in range(batch_size)]
+
+        for i in range(next_words):
+            with np.errstate(divide='ignore'):
+                log_probs = np.log(probabilities.astype(np.float64))
+                # All stop ids collapse into a single "finish" candidate at id 0
+                log_probs[:, 0] = np.log(probabilities[:, stop_ids].sum(axis=1))
+            log_probs[:, stop_ids[1:]] = -np.inf
+            # Finished beams can only extend with id 0, at no cost
+            log_probs[finished] = -np.inf
+            log_probs[finished, 0] = 0.0
+
+            candidates = (scores[:, None] + log_probs).reshape(len(prompts), num_beams * vocab_size)
+            top = np.argpartition(-candidates, num_beams - 1, axis=1)[:, :num_beams]
+            order = np.argsort(-np.take_along_axis(candidates, top, axis=1), axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+
+            scores = np.take_along_axis(candidates, top, axis=1).reshape(-1)
+            origin = (top // vocab_size + np.arange(len(prompts))[:, None] * num_beams).reshape(-1)
+            next_ids = (top % vocab_size).reshape(-1)
+            sequences = np.concatenate([sequences[origin], next_ids[:, None]], axis=1)
+            finished = finished[origin] | (next_ids == 0)
+            states = [state[origin] for state in states]
+            if windows is not None:
+                windows = windows[origin]
+
+            # Prompts whose beams have all finished leave the batch with their best beam
+            done = finished.reshape(len(prompts), num_beams).all(axis=1)
+            if i == next_words - 1:
+                done[:] = True
+            for group in np.flatnonzero(done):
+                best = sequences[group * num_beams]
+                stops = np.flatnonzero(best == 0)
+                results[prompts[group]] = best[:stops[0] if len(stops) else len(best)].tolist()
+            if done.all():
+                break
+
+            keep = np.repeat(~done, num_beams)
+            prompts = prompts[~done]
+            scores, sequences, finished, next_ids = scores[keep], sequences[keep], finished[keep], next_ids[keep]
+            states = [state[keep] for state in states]
+            windows = None if windows is None else windows[keep]
+            probabilities, states, windows = self.advance(next_ids, states, windows)
+
+        return results
+
+
+def sample_next(probabilities, temperature=0.0, top_k=None, top_p=None, rng=None):
+    """Pick one id per row: argmax at temperature 0, otherwise sample after top-k/top-p filtering"""
+    if not temperature:
+        return np.argmax(probabilities, axis=1)
+
+    rng = rng or np.random.default_rng()
+    with np.errstate(divide='ignore'):
+        logits = np.log(probabilities.astype(np.float64)) / temperature
+
+    if top_k:
+        kth = np.partition(logits, -top_k, axis=1)[:, -top_k][:, None]
+        logits[logits < kth] = -np.inf
+
+    probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+    if top_p is not None and top_p < 1.0:
+        # Keep the smallest set of most likely ids whose mass reaches top_p
+        order = np.argsort(-probabilities, axis=1)
+        sorted_probs = np.take_along_axis(probabilities, order, axis=1)
+        outside = np.cumsum(sorted_probs, axis=1) - sorted_probs >= top_p
+        np.put_along_axis(probabilities, order, np.where(outside, 0.0, sorted_probs), axis=1)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+
+    # Inverse-CDF sampling, one uniform draw per row
+    cumulative = np.cumsum(probabilities, axis=1)
+    draws = rng.random((len(probabilities), 1)) * cumulative[:, -1:]
+    return np.minimum((cumulative < draws).sum(axis=1), probabilities.shape[1] - 1)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from multiprocessing import Pool
+import numpy as np
+
+
+# Same defaults as tf.keras.preprocessing.text.Tokenizer
+DEFAULT_FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+
+class CompactTokenizer:
+    """Word tokenizer with Keras Tokenizer semantics whose vocabulary lives in flat arrays"""
+
+    def __init__(self, num_words=None, filters=DEFAULT_FILTERS, lower=True, split=' ', oov_token=None):
+        self.num_words = num_words
+        self.filters = filters
+        self.lower = lower
+        self.split = split
+        self.oov_token = oov_token
+        # Word i (id i + 1) is blob[offsets[i]:offsets[i + 1]], ids in descending frequency
+        self.blob = np.zeros(0, dtype=np.uint8)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._word_index = None
+        self._index_word = None
+        self._translation = str.maketrans({c: split for c in filters})
+
+    def split_text(self, text):
+        if self.lower:
+            text = text.lower()
+        return [word for word in text.translate(self._translation).split(self.split) if word]
+
+    def count_words(self, texts):
+        word_counts = Counter()
+        for text in texts:
+            word_counts.update(self.split_text(text))
+        return word_counts
+
+    def fit_on_texts(self, texts):
+        """Count words and assign ids by descending count, ties in order of first appearance"""
+        self.fit_on_counts(self.count_words(texts))
+
+    def fit_on_counts(self, word_counts):
+        """Assign ids from word counts merged in corpus order, e.g. one Counter per chunk"""
+        # Counter keeps first-appearance order and sorted() is stable, matching Keras
+        ranked = sorted(word_counts.items(), key=lambda item: item[1], reverse=True)
+        words = ([self.oov_token] if self.oov_token is not None else []) + [word for word, _ in ranked]
+        counts = ([0] if self.oov_token is not None else []) + [count for _, count in ranked]
+        self.set_vocabulary(words, counts)
+
+    def set_vocabulary(self, words, counts=None):
+        encoded = [word.encode('utf-8') for word in words]
+        self.blob = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+        self.offsets = np.concatenate([[0], np.cumsum([len(word) for word in encoded])]).astype(np.int64)
+        self.counts = np.asarray(counts if counts is not None else [0] * len(words), dtype=np.int64)
+        self._word_index = None
+        self._index_word = None
+
+    @property
+    def word_index(self):
+        if self._word_index is None:
+            self._word_index = {word: i + 1 for i, word in enumerate(self.words())}
+        return self._word_index
+
+    @property
+    def index_word(self):
+        if self._index_word is None:
+            self._index_word = {i: word for word, i in self.word_index.items()}
+        return self._index_word
+
+    def words(self):
+        data = self.blob.tobytes()
+        return [data[start:end].decode('utf-8') for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def encode_bulk(self, texts, processes=None, chunk_size=20000):
+        """Encode many texts into one flat int32 id array plus line offsets, optionally across processes"""
+        texts = list(texts)
+        if processes and processes > 1 and len(texts) > chunk_size:
+            chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+            with Pool(processes, initializer=_init_worker, initargs=(self.get_config(), self.blob, self.offsets)) as pool:
+                parts = pool.map(_encode_chunk, chunks)
+        else:
+            parts = [self._encode_chunk(texts)]
+
+        tokens = np.concatenate([part[0] for part in parts])
+        lengths = np.concatenate([part[1] for part in parts])
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return tokens, offsets
+
+    def _encode_chunk(self, texts):
+        lookup = self.word_index.get
+        oov_index = lookup(self.oov_token, 0) if self.oov_token is not None else 0
+        words, lengths = [], np.zeros(len(texts), dtype=np.int64)
+        for row, text in enumerate(texts):
+            split = self.split_text(text)
+            words.extend(split)
+            lengths[row] = len(split)
+
+        ids = np.fromiter((lookup(word, 0) for word in words), dtype=np.int32, count=len(words))
+        if self.num_words:
+            ids[ids >= self.num_words] = 0
+        # Unknown words map to the OOV id, or are dropped when there is none
+        ids[ids == 0] = oov_index
+        if not oov_index:
+            rows = np.repeat(np.arange(len(texts)), lengths)
+            keep = ids != 0
+            ids = ids[keep]
+            lengths = np.bincount(rows[keep], minlength=len(texts)).astype(np.int64)
+        return ids, lengths
+
+    def texts_to_sequences(self, texts):
+        tokens, offsets = self.encode_bulk(texts)
+        return [tokens[start:end].tolist() for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def get_config(self):
+        return {'num_words': self.num_words, 'filters': self.filters, 'lower': self.lower,
+                'split': self.split, 'oov_token': self.oov_token}
+
+    def fingerprint(self):
+        """Content hash of the vocabulary and splitting rules"""
+        digest = hashlib.sha256(json.dumps(self.get_config(), sort_keys=True).encode())
+        digest.update(self.blob.tobytes())
+        digest.update(self.offsets.tobytes())
+        return digest.hexdigest()
+
+    def save(self, path):
+        np.savez(path, blob=self.blob, offsets=self.offsets, counts=self.counts,
+                 config=np.array(json.dumps(self.get_config())))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as saved:
+            tokenizer = cls(**json.loads(str(saved['config'])))
+            tokenizer.blob, tokenizer.offsets, tokenizer.counts = saved['blob'], saved['offsets'], saved['counts']
+        return tokenizer
+
+    @classmethod
+    def from_keras(cls, keras_tokenizer):
+        """Convert a fitted (possibly unpickled) Keras Tokenizer, keeping its ids"""
+        tokenizer = cls(num_words=keras_tokenizer.num_words, filters=keras_tokenizer.filters,
+                        lower=keras_tokenizer.lower, split=keras_tokenizer.split,
+                        oov_token=keras_tokenizer.oov_token)
+        ranked = sorted(keras_tokenizer.word_index.items(), key=lambda item: item[1])
+        tokenizer.set_vocabulary([word for word, _ in ranked],
+                                 [keras_tokenizer.word_counts.get(word, 0) for word, _ in ranked])
+        return tokenizer
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(config, blob, offsets):
+    global _worker_tokenizer
+    _worker_tokenizer = CompactTokenizer(**config)
+    _worker_tokenizer.blob, _worker_tokenizer.offsets = blob, offsets
+
+
+def _encode_chunk(texts):
+    return _worker_tokenizer._encode_chunk(texts)
+
+
+def _count_chunk(texts):
+    return _worker_tokenizer.count_words(texts)
+
+
+def corpus_fingerprint(texts):
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def load_or_encode(texts, tokenizer, cache_dir, processes=None):
+    """Memory-map the cached ids for this corpus and vocabulary, encoding and caching them on a miss"""
+    key = hashlib.sha256((corpus_fingerprint(texts) + tokenizer.fingerprint()).encode()).hexdigest()[:32]
+    tokens_path = os.path.join(cache_dir, f"{key}.tokens.npy")
+    offsets_path = os.path.join(cache_dir, f"{key}.offsets.npy")
+
+    if os.path.exists(tokens_path) and os.path.exists(offsets_path):
+        return np.load(tokens_path, mmap_mode='r'), np.load(offsets_path, mmap_mode='r')
+
+    tokens, offsets = tokenizer.encode_bulk(texts, processes=processes)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write under a temporary name and rename, so an interrupted run never leaves a torn cache
+    for path, array in ((tokens_path, tokens), (offsets_path, offsets)):
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(path + '.tmp', path)
+    return np.load(tokens_path, mmap_mode='r'), np.load(offsets_path, mmap_mode='r')
@@ -0,0 +1,62 @@
+import tensorflow as tf
+from tensorflow.keras.layers import Input, Embedding, LSTM, Dense, Dropout
+from tensorflow.keras.models import Model
+import numpy as np
+from decoding import BatchDecoder
+
+
+class GenerationEngine(BatchDecoder):
+    """Inference-time copy of a trained SimpleLLM that carries LSTM state between tokens"""
+
+    def __init__(self, model):
+        self.source_model = model
+
+        # Dropout is a no-op at inference, so only the weighted layers are copied
+        layers = [layer for layer in model.layers if not isinstance(layer, Dropout)]
+        embedding, lstms, dense = layers[0], layers[1:-1], layers[-1]
+        self.total_words = embedding.input_dim
+        self.state_units = [units for lstm in lstms for units in (lstm.units, lstm.units)]
+
+        # Same stack, but every LSTM takes and returns its hidden and cell state
+        tokens = Input(shape=(None,), dtype='int32')
+        state_inputs = [Input(shape=(units,)) for units in self.state_units]
+        x = Embedding(embedding.input_dim, embedding.output_dim)(tokens)
+        state_outputs = []
+        for i, lstm in enumerate(lstms):
+            last = i == len(lstms) - 1
+            x, h, c = LSTM(lstm.units, return_sequences=not last, return_state=True)(
+                x, initial_state=state_inputs[2 * i:2 * i + 2])
+            state_outputs += [h, c]
+        probabilities = Dense(dense.units, activation='softmax')(x)
+        self.model = Model([tokens] + state_inputs, [probabilities] + state_outputs)
+
+        weighted = [layer for layer in self.model.layers if layer.weights]
+        for target, source in zip(weighted, layers):
+            target.set_weights(source.get_weights())
+
+        # One traced graph serves prompts of any length and any batch size
+        signature = [
+            tf.TensorSpec([None, None], tf.int32),
+            [tf.TensorSpec([None, units], tf.float32) for units in self.state_units],
+        ]
+        self._forward = tf.function(self._call, input_signature=signature)
+
+    def _call(self, tokens, states):
+        outputs = self.model([tokens] + list(states), training=False)
+        return outputs[0], outputs[1:]
+
+    def initial_state(self, batch_size=1):
+        """Zero hidden and cell states for every LSTM layer"""
+        return [np.zeros((batch_size, units), dtype=np.float32) for units in self.state_units]
+
+    def encode(self, token_ids, states=None):
+        """Run a (batch, length) block of token ids and return next-token probabilities and states"""
+        token_ids = np.asarray(token_ids, dtype=np.int32)
+        if states is None:
+            states = self.initial_state(len(token_ids))
+        probabilities, states = self._forward(token_ids, states)
+        return probabilities.numpy(), [state.numpy() for state in states]
+
+    def step(self, token_ids, states):
+        """Feed one token per sequence, costing a single LSTM step regardless of context length"""
+        return self.encode(np.asarray(token_ids, dtype=np.int32)[:, None], states)
@@ -0,0 +1,172 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+import numpy as np
+import tensorflow as tf
+
+
+def read_status_mb(field):
+    """A /proc/self/status memory field such as VmRSS or VmHWM in MB, None where unavailable"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss():
+    """Restart VmHWM from the current RSS, so the next reading is the peak of one span (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+class RunLog:
+    """Structured metrics for one training run, appended to a JSONL file when a path is given"""
+
+    def __init__(self, path=None, run_id=None):
+        self.path = path
+        self.run_id = run_id or time.strftime('%Y%m%d-%H%M%S')
+        self.events = []
+        self._spans = []
+        self._file = None
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._file = open(path, 'a')
+
+    def event(self, kind, **fields):
+        record = dict(run=self.run_id, event=kind, time=time.time(), **fields)
+        self.events.append(record)
+        if self._file:
+            self._file.write(json.dumps(record, sort_keys=True) + '\n')
+            self._file.flush()
+        return record
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Time one pipeline stage and record its RSS at start, end and peak"""
+        if self._spans:
+            # Fold the parent's peak so far in before the reset below forgets it
+            self._spans[-1]['peak'] = peak(self._spans[-1]['peak'], read_status_mb('VmHWM'))
+        exact_peak = reset_peak_rss()
+        frame = {'peak': None}
+        self._spans.append(frame)
+        rss_start = read_status_mb('VmRSS')
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._spans.pop()
+            frame['peak'] = peak(frame['peak'], read_status_mb('VmHWM'))
+            if self._spans:
+                self._spans[-1]['peak'] = peak(self._spans[-1]['peak'], frame['peak'])
+            # Without clear_refs the peak is the process-wide high-water mark
+            self.event('span', name=name, seconds=seconds, rss_start_mb=rss_start,
+                       rss_end_mb=read_status_mb('VmRSS'), peak_rss_mb=frame['peak'],
+                       exact_peak=exact_peak, **fields)
+
+    def summary(self):
+        spans = [event for event in self.events if event['event'] == 'span']
+        if not spans:
+            return
+        print(f"{'stage':<16} {'seconds':>9} {'peak RSS MB':>12}")
+        for event in spans:
+            peak_mb = f"{event['peak_rss_mb']:.1f}" if event['peak_rss_mb'] is not None else '-'
+            print(f"{event['name']:<16} {event['seconds']:>9.3f} {peak_mb:>12}")
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class TrainingMetrics(tf.keras.callbacks.Callback):
+    """Per-epoch step times, samples and tokens per second, and time blocked on checkpoint I/O
+
+    tokens_per_epoch counts the input tokens the model reads, padding excluded.
+
+    With profile_steps=(start, stop) a TensorFlow profiler trace of those global steps is
+    written to profile_dir, viewable in TensorBoard's profile tab.
+    """
+
+    def __init__(self, run_log, samples_per_epoch, tokens_per_epoch, checkpoint_manager=None,
+                 profile_steps=None, profile_dir=None):
+        super().__init__()
+        self.run_log = run_log
+        self.samples_per_epoch = samples_per_epoch
+        self.tokens_per_epoch = tokens_per_epoch
+        self.checkpoint_manager = checkpoint_manager
+        self.profile_steps = profile_steps
+        self.profile_dir = profile_dir
+        self.profiling = False
+
+    def _io_seconds(self):
+        return self.checkpoint_manager.io_seconds if self.checkpoint_manager else 0.0
+
+    def on_train_begin(self, logs=None):
+        self.train_start = time.perf_counter()
+        self.train_io_start = self._io_seconds()
+        # Counted on the host from here on; reading optimizer.iterations every step would sync with the device
+        self.step = int(self.model.optimizer.iterations.numpy())
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.step_seconds = []
+        self.epoch_start = time.perf_counter()
+        self.epoch_io_start = self._io_seconds()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps and self.step == self.profile_steps[0] and not self.profiling:
+            tf.profiler.experimental.start(self.profile_dir)
+            self.profiling = True
+        self.step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step_seconds.append(time.perf_counter() - self.step_start)
+        self.step += 1
+        if self.profiling and self.step >= self.profile_steps[1]:
+            self._stop_profiler()
+
+    def on_epoch_end(self, epoch, logs=None):
+        seconds = time.perf_counter() - self.epoch_start
+        steps = np.array(self.step_seconds) * 1000
+        record = self.run_log.event(
+            'epoch',
+            epoch=epoch + 1,
+            seconds=seconds,
+            steps=len(steps),
+            step_ms_mean=float(steps.mean()) if len(steps) else None,
+            step_ms_p50=float(np.percentile(steps, 50)) if len(steps) else None,
+            step_ms_p95=float(np.percentile(steps, 95)) if len(steps) else None,
+            samples_per_s=self.samples_per_epoch / seconds,
+            tokens_per_s=self.tokens_per_epoch / seconds,
+            checkpoint_blocked_s=self._io_seconds() - self.epoch_io_start,
+            rss_mb=read_status_mb('VmRSS'),
+            **{key: float(value) for key, value in (logs or {}).items()},
+        )
+        print(f"Epoch {epoch + 1}: {record['samples_per_s']:.0f} samples/s, {record['tokens_per_s']:.0f} tokens/s, "
+              f"step p50 {record['step_ms_p50'] or 0:.1f} ms, checkpoint blocked {record['checkpoint_blocked_s']:.3f} s")
+
+    def on_train_end(self, logs=None):
+        if self.profiling:
+            self._stop_profiler()
+        self.run_log.event('train', seconds=time.perf_counter() - self.train_start,
+                           checkpoint_blocked_s=self._io_seconds() - self.train_io_start)
+
+    def _stop_profiler(self):
+        tf.profiler.experimental.stop()
+        self.profiling = False
+        self.run_log.event('profile', steps=list(self.profile_steps), logdir=self.profile_dir)
+        print(f"Profiler trace for steps {self.profile_steps[0]}-{self.profile_steps[1]} written to {self.profile_dir}")
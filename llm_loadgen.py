@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import json
+import time
+
+
+async def post(reader, writer, host, payload):
+    """Send one POST /generate on an open keep-alive connection and return (status, body)"""
+    body = json.dumps(payload).encode()
+    writer.write((f"POST /generate HTTP/1.1\r\nHost: {host}\r\n"
+                  f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode('latin-1') + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(args, prompts, counter, latencies, statuses):
+    """One concurrent client: keeps a connection open and sends requests until the total is reached"""
+    if args.unix_socket:
+        reader, writer = await asyncio.open_unix_connection(args.unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        while True:
+            index = next(counter)
+            if index >= args.requests:
+                break
+            payload = {'prompt': prompts[index % len(prompts)], 'next_words': args.next_words}
+            start = time.perf_counter()
+            status, _ = await post(reader, writer, args.host, payload)
+            elapsed = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed * 1000)
+    finally:
+        writer.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def run(args):
+    prompts = args.prompt or ["Once upon a time", "The parish includes", "Great Steeping was"]
+    counter = iter(range(args.requests * 2))
+    latencies, statuses = [], {}
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args, prompts, counter, latencies, statuses)
+                           for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'statuses': statuses,
+        'elapsed_s': elapsed,
+        'requests_per_s': args.requests / elapsed,
+        'completed_per_s': statuses.get(200, 0) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'max_ms': max(latencies, default=float('nan')),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for llm_server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--next-words", type=int, default=15)
+    parser.add_argument("--prompt", action="append", help="Prompt to send (repeatable)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"Requests:    {report['requests']} ({report['concurrency']} concurrent) {report['statuses']}")
+    print(f"Throughput:  {report['requests_per_s']:.1f} req/s ({report['completed_per_s']:.1f} completed/s) "
+          f"over {report['elapsed_s']:.2f}s")
+    print(f"Latency ms:  p50 {report['p50_ms']:.1f}  p95 {report['p95_ms']:.1f}  "
+          f"p99 {report['p99_ms']:.1f}  max {report['max_ms']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from llm_with_saving import SimpleLLM
+
+
+# Decoding settings a request may override; requests only share a batch when these match
+DECODING_DEFAULTS = {
+    'next_words': 15,
+    'temperature': 0.0,
+    'top_k': None,
+    'top_p': None,
+    'num_beams': 1,
+    'stop_words': None,
+    'exact': True,
+}
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+class RequestError(Exception):
+    """A request rejected before its body is read; the connection is answered and closed"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def parse_request(body, total_words, max_next_words, max_num_beams):
+    """The prompt and full decoding settings of a /generate body; raises ValueError when invalid"""
+    request = json.loads(body or b'{}')
+    if not isinstance(request, dict):
+        raise ValueError("body must be a JSON object")
+    request = dict(request)
+    prompt = request.pop('prompt', None)
+    if not isinstance(prompt, str):
+        raise ValueError("prompt must be a string")
+    unknown = set(request) - set(DECODING_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown fields {sorted(unknown)}")
+    decoding = dict(DECODING_DEFAULTS, **request)
+
+    # A bad setting would fail every request batched with it, so all are checked up front
+    if not (is_int(decoding['next_words']) and 1 <= decoding['next_words'] <= max_next_words):
+        raise ValueError(f"next_words must be an integer from 1 to {max_next_words}")
+    if not (is_int(decoding['num_beams']) and 1 <= decoding['num_beams'] <= max_num_beams):
+        raise ValueError(f"num_beams must be an integer from 1 to {max_num_beams}")
+    if not (is_number(decoding['temperature']) and decoding['temperature'] >= 0):
+        raise ValueError("temperature must be a number >= 0")
+    if decoding['top_k'] is not None and not (is_int(decoding['top_k']) and 1 <= decoding['top_k'] <= total_words):
+        raise ValueError(f"top_k must be an integer from 1 to {total_words}")
+    if decoding['top_p'] is not None and not (is_number(decoding['top_p']) and 0 < decoding['top_p'] <= 1):
+        raise ValueError("top_p must be a number in (0, 1]")
+    if not isinstance(decoding['exact'], bool):
+        raise ValueError("exact must be true or false")
+    stop_words = decoding['stop_words']
+    if stop_words is not None and not (isinstance(stop_words, list) and all(isinstance(word, str) for word in stop_words)):
+        raise ValueError("stop_words must be a list of strings")
+    return prompt, decoding
+
+
+class MicroBatcher:
+    """Collects concurrent generation requests into batched generate_batch calls"""
+
+    def __init__(self, llm, max_batch_size=32, max_wait_ms=5.0, max_queue_depth=256):
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue_depth)
+        # TensorFlow already spreads each forward pass over every core,
+        # so one model thread keeps the event loop free without oversubscribing
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.stats = {'requests': 0, 'rejected': 0, 'batches': 0, 'batched_requests': 0}
+
+    async def submit(self, prompt, decoding):
+        """Queue one prompt and wait for its text; raises asyncio.QueueFull when saturated"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((prompt, decoding, future))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise
+        self.stats['requests'] += 1
+        return await future
+
+    async def run(self):
+        """Form batches forever: wait for one request, then gather more until full or timed out"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Clients that went away no longer need their rows computed
+            batch = [item for item in batch if not item[2].done()]
+
+            groups = {}
+            for item in batch:
+                key = json.dumps(item[1], sort_keys=True)
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                await self._run_group(items)
+
+    async def _run_group(self, items):
+        prompts = [prompt for prompt, _, _ in items]
+        decoding = items[0][1]
+        self.stats['batches'] += 1
+        self.stats['batched_requests'] += len(items)
+        try:
+            texts = await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(self.llm.generate_batch, prompts, **decoding))
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), text in zip(items, texts):
+            if not future.done():
+                future.set_result(text)
+
+
+class GenerationServer:
+    """Long-running HTTP front end that loads a checkpoint once and serves generate requests"""
+
+    def __init__(self, llm, batcher, max_next_words=256, max_num_beams=8, max_body_bytes=2**16):
+        self.llm = llm
+        self.batcher = batcher
+        # Caps on one request's work, so no request holds the model thread for long
+        self.max_next_words = max_next_words
+        self.max_num_beams = max_num_beams
+        self.max_body_bytes = max_body_bytes
+        self.started = time.time()
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until the client closes it"""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_bytes)
+                except RequestError as e:
+                    # The unread body would be parsed as the next request, so the connection ends here
+                    write_response(writer, e.status, {'error': str(e)}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/stats':
+            stats = dict(self.batcher.stats, queue_depth=self.batcher.queue.qsize(),
+                         uptime=time.time() - self.started)
+            if self.llm.prefix_cache is not None:
+                stats['prefix_cache'] = self.llm.prefix_cache.usage()
+            return 200, stats
+        if path != '/generate':
+            return 404, {'error': f"Unknown path {path}"}
+        if method != 'POST':
+            return 405, {'error': "Use POST"}
+
+        try:
+            prompt, decoding = parse_request(body, self.llm.total_words, self.max_next_words, self.max_num_beams)
+        except ValueError as e:
+            return 400, {'error': f"Bad request: {e}"}
+
+        start = time.perf_counter()
+        try:
+            text = await self.batcher.submit(prompt, decoding)
+        except asyncio.QueueFull:
+            return 503, {'error': "Server busy, retry later"}
+        except Exception as e:
+            return 500, {'error': str(e)}
+        return 200, {'text': text, 'latency_ms': (time.perf_counter() - start) * 1000}
+
+
+async def read_request(reader, max_body_bytes):
+    """Read one HTTP request; returns None when the connection closed cleanly"""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = headers.get('content-length', '0')
+    if not length.isdigit():
+        raise RequestError(400, "Content-Length must be a non-negative integer")
+    length = int(length)
+    if length > max_body_bytes:
+        raise RequestError(413, f"Body is over {max_body_bytes} bytes")
+    body = await reader.readexactly(length) if length else b''
+    return method, path, headers, body
+
+
+def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+
+
+async def serve(args):
+    llm = SimpleLLM(args.model_name)
+    if not llm.load_checkpoint(epoch=args.epoch):
+        raise SystemExit(f"No checkpoint found for {args.model_name}")
+    if args.prefix_cache_mb > 0:
+        llm.enable_prefix_cache(max_mb=args.prefix_cache_mb)
+    # Trace the generation graph before the first request arrives
+    llm.generate_batch(["warm up"], next_words=2)
+
+    batcher = MicroBatcher(llm, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                           max_queue_depth=args.max_queue_depth)
+    server = GenerationServer(llm, batcher, max_next_words=args.max_next_words, max_num_beams=args.max_num_beams,
+                              max_body_bytes=args.max_body_bytes)
+
+    if args.unix_socket:
+        listener = await asyncio.start_unix_server(server.handle_connection, path=args.unix_socket)
+        print(f"Serving {args.model_name} on unix:{args.unix_socket}")
+    else:
+        listener = await asyncio.start_server(server.handle_connection, args.host, args.port)
+        print(f"Serving {args.model_name} on http://{args.host}:{args.port}")
+
+    batch_task = asyncio.create_task(batcher.run())
+    async with listener:
+        await asyncio.gather(listener.serve_forever(), batch_task)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SimpleLLM inference server with dynamic micro-batching")
+    parser.add_argument("--model-name", default="fairy_tale_model")
+    parser.add_argument("--epoch", type=int, default=None, help="Serve a specific epoch checkpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", default=None, help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0,
+                        help="How long the first request in a batch waits for company")
+    parser.add_argument("--max-queue-depth", type=int, default=256,
+                        help="Queued requests beyond this are rejected with 503")
+    parser.add_argument("--max-next-words", type=int, default=256, help="Longest generation one request may ask for")
+    parser.add_argument("--max-num-beams", type=int, default=8, help="Widest beam search one request may ask for")
+    parser.add_argument("--max-body-bytes", type=int, default=2**16,
+                        help="Larger request bodies are rejected with 413 before they are read")
+    parser.add_argument("--prefix-cache-mb", type=float, default=0,
+                        help="Memory for cached prompt-prefix states (default 0, off: prompts of different "
+                             "lengths do not share states)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,156 @@
 import tensorflow as tf
-from tensorflow.keras.layers import Embedding, LSTM, Dense, Dropout
+from tensorflow.keras.layers import Input, Embedding, LSTM, Dense, Dropout
 from tensorflow.keras.models import Sequential, load_model
-from tensorflow.keras.preprocessing.text import Tokenizer
-from tensorflow.keras.preprocessing.sequence import pad_sequences
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
+from tensorflow.keras.callbacks import Callback, EarlyStopping
 import numpy as np
+from generation import GenerationEngine
+from fast_tokenizer import CompactTokenizer, load_or_encode
+from corpus import ShardedCorpus, context_windows, count_window_tokens, target_positions, window_batches
+from checkpoint_manager import CheckpointManager, choose_checkpoint
+from decoding import generate_texts
+from prefix_cache import PrefixCache
+from instrumentation import RunLog, TrainingMetrics
+from data_parallel import configure_cpu_replicas
+from contextlib import nullcontext
 import pickle
 import os
 
+def sampled_softmax_loss(head, hidden, labels, num_sampled):
+    """Sampled softmax loss computed against the columns of a Dense output head"""
+    num_sampled = min(num_sampled, head.units)
+    # Tokenizer ids are assigned by descending frequency, so a log-uniform
+    # (Zipfian) candidate sampler matches the word distribution well
+    sampled, true_expected, sampled_expected = tf.random.log_uniform_candidate_sampler(
+        true_classes=labels[:, None], num_true=1, num_sampled=num_sampled,
+        unique=True, range_max=head.units)
+    
+    # Only the columns of the true and sampled classes are ever touched
+    true_logits = tf.reduce_sum(hidden * tf.transpose(tf.gather(head.kernel, labels, axis=1)), axis=1)
+    true_logits += tf.gather(head.bias, labels) - tf.math.log(tf.reshape(true_expected, [-1]))
+    sampled_logits = tf.matmul(hidden, tf.gather(head.kernel, sampled, axis=1))
+    sampled_logits += tf.gather(head.bias, sampled) - tf.math.log(sampled_expected)
+    
+    # Drop samples that happen to be the true class
+    accidental_hits = tf.equal(labels[:, None], sampled[None, :])
+    sampled_logits = tf.where(accidental_hits, tf.fill(tf.shape(sampled_logits), -1e9), sampled_logits)
+    
+    logits = tf.concat([true_logits[:, None], sampled_logits], axis=1)
+    return tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(
+        labels=tf.zeros_like(labels), logits=logits))
+
+
+class SampledSoftmaxSequential(Sequential):
+    """Sequential model trained with sampled softmax, predicting with the full softmax head"""
+    
+    def __init__(self, layers=None, name=None, num_sampled=64):
+        super().__init__(layers=layers, name=name)
+        self.num_sampled = num_sampled
+        self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+    
+    @property
+    def metrics(self):
+        # fit() reports (and resets every epoch) the metrics listed here, so 'loss' is this running mean
+        return [self.loss_tracker]
+    
+    def train_step(self, data):
+        X, y = data
+        labels = tf.reshape(tf.cast(y, tf.int64), [-1])
+        head = self.layers[-1]
+        
+        with tf.GradientTape() as tape:
+            hidden = X
+            for layer in self.layers[:-1]:
+                hidden = layer(hidden, training=True)
+            loss = sampled_softmax_loss(head, hidden, labels, self.num_sampled)
+            # Replica gradients are summed, so each contributes its share of the global mean
+            scaled_loss = loss / tf.distribute.get_strategy().num_replicas_in_sync
+        
+        gradients = tape.gradient(scaled_loss, self.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+        self.loss_tracker.update_state(loss)
+        return {'loss': self.loss_tracker.result()}
+    
+    def get_config(self):
+        config = super().get_config()
+        config['num_sampled'] = self.num_sampled
+        return config
+    
+    @classmethod
+    def from_config(cls, config, custom_objects=None):
+        config = dict(config)
+        num_sampled = config.pop('num_sampled', 64)
+        model = super().from_config(config, custom_objects=custom_objects)
+        model.num_sampled = num_sampled
+        return model
+
+
+class SegmentSequential(Sequential):
+    """Stateful Sequential trained on consecutive segments of documents (truncated BPTT)
+    
+    Batches are ((segments, fresh), targets, weights): the LSTM state runs on from the
+    previous batch except in rows flagged fresh, which start a new document.
+    """
+    
+    def __init__(self, layers=None, name=None):
+        super().__init__(layers=layers, name=name)
+        self.loss_tracker = tf.keras.metrics.Mean(name='loss')
+    
+    @property
+    def metrics(self):
+        return [self.loss_tracker]
+    
+    def train_step(self, data):
+        (X, fresh), y, weights = data
+        keep = 1.0 - tf.cast(fresh, tf.float32)[:, None]
+        for layer in self.layers:
+            if getattr(layer, 'stateful', False):
+                for state in layer.states:
+                    state.assign(state * keep)
+        
+        with tf.GradientTape() as tape:
+            probabilities = self(X, training=True)
+            losses = tf.keras.losses.sparse_categorical_crossentropy(y, probabilities)
+            # Mean over real target tokens, padding carries zero weight
+            loss = tf.reduce_sum(losses * weights) / tf.maximum(tf.reduce_sum(weights), 1.0)
+        
+        gradients = tape.gradient(loss, self.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+        self.loss_tracker.update_state(loss, sample_weight=tf.reduce_sum(weights))
+        return {'loss': self.loss_tracker.result()}
+
+
+class AsyncCheckpoint(Callback):
+    """Hands weight and optimizer snapshots to a CheckpointManager at epoch or step boundaries"""
+    
+    def __init__(self, manager, every_epochs=None, every_steps=None, monitor='loss'):
+        super().__init__()
+        self.manager = manager
+        self.every_epochs = every_epochs
+        self.every_steps = every_steps
+        self.monitor = monitor
+        self.epoch = 0
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+    
+    def on_train_batch_end(self, batch, logs=None):
+        if self.every_steps:
+            step = int(self.model.optimizer.iterations.numpy())
+            if step % self.every_steps == 0:
+                # Mid-epoch snapshots record the completed epochs, so resume replays the whole partial
+                # epoch on these weights; the batches before this step are seen twice
+                self.manager.save(self.model, epoch=self.epoch, step=step)
+    
+    def on_epoch_end(self, epoch, logs=None):
+        loss = (logs or {}).get(self.monitor)
+        improved = loss is not None and (self.manager.best_loss is None or loss < self.manager.best_loss)
+        if improved or (self.every_epochs and (epoch + 1) % self.every_epochs == 0):
+            self.manager.save(self.model, epoch=epoch + 1, step=int(self.model.optimizer.iterations.numpy()), loss=loss)
+    
+    def on_train_end(self, logs=None):
+        self.manager.wait()
+
+
 class SimpleLLM:
     def __init__(self, model_name="simple_llm"):
         self.model_name = model_name
@@ -15,77 +158,324 @@ class SimpleLLM:
         self.tokenizer = None
         self.max_sequence_length = None
         self.total_words = None
+        self.engine = None
+        self.prefix_cache = None
+        self.run_log = None
+        # Non-padding input tokens per epoch, set by the prepare_* methods for throughput metrics
+        self.tokens_per_epoch = None
+    
+    def span(self, name, **fields):
+        """Time a pipeline stage into the active run log, if any"""
+        return self.run_log.span(name, **fields) if self.run_log else nullcontext()
         
-    def prepare_data(self, data):
-        """Tokenize and prepare sequence data"""
-        self.tokenizer = Tokenizer()
-        self.tokenizer.fit_on_texts(data)
+    def tokenize_corpus(self, data, reuse_tokenizer=False, processes=None):
+        """Fit (or reuse the saved) tokenizer and return the corpus as flat token ids and line offsets"""
+        if not (reuse_tokenizer and self.load_tokenizer()):
+            self.tokenizer = CompactTokenizer()
+            self.tokenizer.fit_on_texts(data)
         self.total_words = len(self.tokenizer.word_index) + 1
         
-        # Create input sequences
-        input_sequences = []
-        for line in data:
-            token_list = self.tokenizer.texts_to_sequences([line])[0]
-            for i in range(1, len(token_list)):
-                n_gram_sequence = token_list[:i+1]
-                input_sequences.append(n_gram_sequence)
+        # Encoded ids are cached per corpus and vocabulary, so reruns memory-map them instead;
+        # on a miss, processes > 1 encodes large corpora in parallel chunks
+        return load_or_encode(data, self.tokenizer, f"checkpoints/{self.model_name}/token_cache",
+                              processes=processes)
+    
+    def prepare_data(self, data, reuse_tokenizer=False, processes=None):
+        """Tokenize and prepare sequence data"""
+        with self.span('tokenize'):
+            tokens, offsets = self.tokenize_corpus(data, reuse_tokenizer, processes)
         
-        self.max_sequence_length = max([len(x) for x in input_sequences])
-        input_sequences = pad_sequences(input_sequences, maxlen=self.max_sequence_length, padding='pre')
+        with self.span('pad'):
+            # One n-gram ends at every token but the first of its line, pre-padded to the longest line
+            positions = target_positions(offsets)
+            if not len(positions):
+                raise ValueError("No training sequences found in data")
+            self.max_sequence_length = int(np.diff(offsets).max())
+            
+            # Filled from the mapped ids a block at a time, bounding the index temporaries
+            input_sequences = np.empty((len(positions), self.max_sequence_length), dtype=np.int32)
+            for start in range(0, len(positions), 65536):
+                block = positions[start:start + 65536]
+                rows = slice(start, start + len(block))
+                input_sequences[rows, :-1] = context_windows(tokens, offsets, block, self.max_sequence_length - 1)
+                input_sequences[rows, -1] = tokens[block]
+            self.tokens_per_epoch = int(np.count_nonzero(input_sequences[:, :-1]))
         
         return input_sequences
     
-    def build_model(self):
+    def prepare_dataset(self, data, window_size=50, batch_size=32, seed=None,
+                        sparse_targets=False, reuse_tokenizer=False, processes=None):
+        """Build a streaming pipeline of fixed-size context windows"""
+        with self.span('tokenize'):
+            tokens, offsets = self.tokenize_corpus(data, reuse_tokenizer, processes)
+        self.max_sequence_length = window_size + 1
+        
+        # Every token except the first of its line is a target; its window is
+        # the preceding window_size ids, zeroed where they fall before the line start
+        num_samples = int(np.maximum(np.diff(offsets) - 1, 0).sum())
+        if not num_samples:
+            raise ValueError("No training sequences found in data")
+        self.tokens_per_epoch = count_window_tokens(offsets, window_size)
+        
+        # Windows are gathered from the memory-mapped ids one batch at a time, reshuffled every epoch
+        rng = np.random.default_rng(seed)
+        dataset = tf.data.Dataset.from_generator(
+            lambda: window_batches(tokens, offsets, window_size, batch_size, rng),
+            output_signature=(tf.TensorSpec([None, window_size], tf.int32), tf.TensorSpec([None], tf.int32))
+        )
+        if not sparse_targets:
+            total_words = self.total_words
+            dataset = dataset.map(lambda X, y: (X, tf.one_hot(y, total_words)))
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(-(-num_samples // batch_size)))
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        
+        return dataset, num_samples
+    
+    def prepare_shard_dataset(self, corpus, window_size=50, batch_size=32, seed=None, sparse_targets=False):
+        """Stream fixed-size windows from a ShardedCorpus, one memory-mapped shard at a time"""
+        self.tokenizer = corpus.tokenizer
+        self.total_words = len(self.tokenizer.word_index) + 1
+        self.max_sequence_length = window_size + 1
+        
+        if not corpus.num_samples:
+            raise ValueError("No training sequences found in corpus")
+        self.tokens_per_epoch = corpus.num_window_tokens(window_size)
+        
+        # One generator per epoch drawing from a shared rng, so each epoch visits the shards in a new order
+        rng = np.random.default_rng(seed)
+        dataset = tf.data.Dataset.from_generator(
+            lambda: corpus.iter_batches(window_size, batch_size, rng),
+            output_signature=(tf.TensorSpec([None, window_size], tf.int32), tf.TensorSpec([None], tf.int32))
+        )
+        if not sparse_targets:
+            total_words = self.total_words
+            dataset = dataset.map(lambda X, y: (X, tf.one_hot(y, total_words)))
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(corpus.num_batches(batch_size)))
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        
+        return dataset, corpus.num_samples
+    
+    def prepare_segments(self, data, segment_length=64, batch_size=32, window_size=50, lead_in=4,
+                         bucket_width=8, seed=None, reuse_tokenizer=False, processes=None):
+        """Batches of contiguous document segments for a stateful model, predicting every position
+        
+        Documents with the same number of segments and a similar last-segment length are
+        grouped into blocks of batch_size rows. A block is fed as consecutive batches, one
+        segment each, so the LSTM state carries across segments; its first batch flags
+        the rows fresh. Returns the dataset and the number of target tokens per epoch.
+        """
+        with self.span('tokenize'):
+            tokens, offsets = self.tokenize_corpus(data, reuse_tokenizer, processes)
+        # Generation still reads a window of the last window_size words
+        self.max_sequence_length = window_size + 1
+        
+        starts, lengths = offsets[:-1], np.diff(offsets)
+        starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+        if not len(lengths):
+            raise ValueError("No training sequences found in data")
+        # Every word but the last of a document is an input
+        self.tokens_per_epoch = int((lengths - 1).sum())
+        
+        # Generation pre-pads prompts with zeros, so each document follows a short run of
+        # padding and the last padding position predicts its first word
+        positions = lead_in - 1 + lengths
+        segments = -(-positions // segment_length)
+        tails = positions - (segments - 1) * segment_length
+        # Bucketed by padded width: whole segments plus the last one rounded up to bucket_width
+        keys = (segments - 1) * segment_length + np.minimum(-(-tails // bucket_width) * bucket_width, segment_length)
+        bucket_keys, bucket_sizes = np.unique(keys, return_counts=True)
+        # One batch per segment of every block
+        num_batches = int((-(-bucket_sizes // batch_size) * -(-bucket_keys // segment_length)).sum())
+        
+        def block_batches(docs):
+            width = int(positions[docs].max())
+            X = np.zeros((batch_size, width), dtype=np.int32)
+            y = np.zeros((batch_size, width), dtype=np.int32)
+            weights = np.zeros((batch_size, width), dtype=np.float32)
+            for row, doc in enumerate(docs):
+                ids = tokens[starts[doc]:starts[doc] + lengths[doc]]
+                X[row, lead_in:lead_in + len(ids) - 1] = ids[:-1]
+                y[row, lead_in - 1:lead_in - 1 + len(ids)] = ids
+                weights[row, lead_in - 1:lead_in - 1 + len(ids)] = 1.0
+            fresh = np.ones(batch_size, dtype=bool)
+            for start in range(0, width, segment_length):
+                end = start + segment_length
+                yield (X[:, start:end], fresh), y[:, start:end], weights[:, start:end]
+                fresh = np.zeros(batch_size, dtype=bool)
+        
+        rng = np.random.default_rng(seed)
+        
+        def generate():
+            # Documents are reshuffled within their bucket and blocks are visited in a new order every epoch
+            order = rng.permutation(len(keys))
+            order = order[np.argsort(keys[order], kind='stable')]
+            buckets = np.split(order, np.flatnonzero(np.diff(keys[order])) + 1)
+            blocks = [bucket[i:i + batch_size] for bucket in buckets for i in range(0, len(bucket), batch_size)]
+            for index in rng.permutation(len(blocks)):
+                yield from block_batches(blocks[index])
+        
+        dataset = tf.data.Dataset.from_generator(generate, output_signature=(
+            (tf.TensorSpec([batch_size, None], tf.int32), tf.TensorSpec([batch_size], tf.bool)),
+            tf.TensorSpec([batch_size, None], tf.int32),
+            tf.TensorSpec([batch_size, None], tf.float32),
+        ))
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(num_batches))
+        dataset = dataset.prefetch(tf.data.AUTOTUNE)
+        
+        return dataset, int(lengths.sum())
+    
+    def build_model(self, sparse_targets=False, num_sampled=None, learning_rate=None):
         """Build the LLM architecture"""
-        self.model = Sequential()
+        if num_sampled:
+            # Sampled softmax trains on integer targets only
+            self.model = SampledSoftmaxSequential(num_sampled=num_sampled)
+            sparse_targets = True
+        else:
+            self.model = Sequential()
         self.model.add(Embedding(self.total_words, 100, input_length=self.max_sequence_length-1))
         self.model.add(LSTM(150, return_sequences=True))
         self.model.add(Dropout(0.2))
         self.model.add(LSTM(100))
         self.model.add(Dense(self.total_words, activation='softmax'))
+        self.model.build((None, self.max_sequence_length-1))
         
-        self.model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+        loss = 'sparse_categorical_crossentropy' if sparse_targets else 'categorical_crossentropy'
+        # The sampled train_step reports its own loss only, so no per-step accuracy
+        metrics = None if num_sampled else ['accuracy']
+        optimizer = tf.keras.optimizers.Adam(learning_rate) if learning_rate else 'adam'
+        self.model.compile(loss=loss, optimizer=optimizer, metrics=metrics)
+    
+    def build_segment_model(self, batch_size, learning_rate=None):
+        """The build_model() stack with stateful LSTMs that predict at every position"""
+        self.model = SegmentSequential()
+        # Stateful layers hold one state row per batch row, so the batch size is fixed
+        self.model.add(Input(batch_shape=(batch_size, None), dtype='int32'))
+        self.model.add(Embedding(self.total_words, 100))
+        self.model.add(LSTM(150, return_sequences=True, stateful=True))
+        self.model.add(Dropout(0.2))
+        self.model.add(LSTM(100, return_sequences=True, stateful=True))
+        self.model.add(Dense(self.total_words, activation='softmax'))
+        self.model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate) if learning_rate else 'adam')
+    
+    def to_window_model(self):
+        """Swap the segment model for the build_model() stack with the same weights, for generation and export"""
+        weights = self.model.get_weights()
+        self.build_model()
+        self.model.set_weights(weights)
     
-    def train_with_checkpoints(self, data, epochs=200, checkpoint_freq=10, resume_training=True):
-        """Train model with automatic checkpointing"""
+    def train_with_checkpoints(self, data, epochs=200, checkpoint_freq=10, resume_training=True,
+                               streaming=False, window_size=50, batch_size=32,
+                               sparse_targets=False, num_sampled=None, checkpoint_steps=None, keep_last=3,
+                               callbacks=None, metrics_log=None, profile_steps=None, profile_dir=None,
+                               data_parallel=None, scale_learning_rate=True, seed=None, segment_length=None,
+                               processes=None):
+        """Train model with automatic checkpointing; data is a list of texts or a ShardedCorpus"""
+        # Integer targets avoid a (num_samples x total_words) one-hot matrix
+        sparse_targets = sparse_targets or bool(num_sampled)
+        if segment_length and (num_sampled or data_parallel or isinstance(data, ShardedCorpus)):
+            raise ValueError("Segment training takes a list of texts and runs the full softmax on one replica")
+        
+        # Data parallelism over data_parallel CPU replicas: batch_size is per replica, so the
+        # global batch grows with the replicas and the learning rate follows it (linear scaling)
+        strategy = configure_cpu_replicas(data_parallel) if data_parallel else None
+        replicas = strategy.num_replicas_in_sync if strategy else 1
+        learning_rate = 0.001 * replicas if scale_learning_rate else 0.001
+        global_batch_size = batch_size * replicas
+        if seed is not None:
+            # Seeds Python, NumPy and TensorFlow; with deterministic ops reruns are bit-identical
+            tf.keras.utils.set_random_seed(seed)
+            tf.config.experimental.enable_op_determinism()
+        
+        # Stage timings and per-epoch throughput, written as JSONL when metrics_log is a path
+        self.run_log = RunLog(metrics_log)
+        self.run_log.event('run_start', model_name=self.model_name, epochs=epochs, batch_size=batch_size,
+                           streaming=streaming, window_size=window_size, sparse_targets=sparse_targets,
+                           num_sampled=num_sampled, replicas=replicas, global_batch_size=global_batch_size,
+                           learning_rate=learning_rate, seed=seed, segment_length=segment_length)
         
         # Prepare data
-        input_sequences = self.prepare_data(data)
-        X, y = input_sequences[:, :-1], input_sequences[:, -1]
-        y = tf.keras.utils.to_categorical(y, num_classes=self.total_words)
+        if segment_length:
+            # Whole documents in contiguous segments, every position a target
+            dataset, num_samples = self.prepare_segments(data, segment_length=segment_length,
+                                                         batch_size=batch_size, window_size=window_size,
+                                                         seed=seed, reuse_tokenizer=resume_training,
+                                                         processes=processes)
+            train_inputs = {'x': dataset}
+        elif isinstance(data, ShardedCorpus):
+            # Pre-tokenized shards from corpus.ingest(); the saved weights must share their vocabulary
+            if resume_training and self.load_tokenizer() and self.tokenizer.fingerprint() != data.tokenizer.fingerprint():
+                raise ValueError(f"Corpus {data.directory} was tokenized with a different vocabulary "
+                                 f"than {self.model_name}")
+            dataset, num_samples = self.prepare_shard_dataset(data, window_size=window_size,
+                                                              batch_size=global_batch_size, seed=seed,
+                                                              sparse_targets=sparse_targets)
+            train_inputs = {'x': dataset}
+        elif streaming:
+            # Fixed-size windows built lazily per batch, memory grows linearly with the corpus
+            dataset, num_samples = self.prepare_dataset(data, window_size=window_size,
+                                                        batch_size=global_batch_size, seed=seed,
+                                                        sparse_targets=sparse_targets,
+                                                        reuse_tokenizer=resume_training, processes=processes)
+            train_inputs = {'x': dataset}
+        else:
+            input_sequences = self.prepare_data(data, reuse_tokenizer=resume_training, processes=processes)
+            X, y = input_sequences[:, :-1], input_sequences[:, -1]
+            if not sparse_targets:
+                with self.span('one_hot'):
+                    y = tf.keras.utils.to_categorical(y, num_classes=self.total_words)
+            num_samples = len(X)
+            train_inputs = {'x': X, 'y': y, 'batch_size': global_batch_size}
         
         # Create directories for saving
         checkpoint_dir = f"checkpoints/{self.model_name}"
         os.makedirs(checkpoint_dir, exist_ok=True)
+        manager = CheckpointManager(checkpoint_dir, keep_last=keep_last)
         
-        # Try to load existing model and tokenizer
-        start_epoch = 0
-        if resume_training and self.load_checkpoint():
-            print(f"Resumed training from existing checkpoint")
-            start_epoch = self.get_last_epoch()
-        else:
-            print("Starting training from scratch")
-            self.build_model()
+        def build():
+            if segment_length:
+                self.build_segment_model(batch_size, learning_rate=learning_rate)
+            else:
+                self.build_model(sparse_targets=sparse_targets, num_sampled=num_sampled,
+                                 learning_rate=learning_rate)
+        
+        # Resume weights, optimizer state and epoch from the latest manifest snapshot; under a
+        # strategy the model and optimizer variables are created mirrored on every replica
+        with strategy.scope() if strategy else nullcontext():
+            with self.span('build_model'):
+                build()
+            start_epoch = 0
+            latest = manager.latest() if resume_training else None
+            if latest is not None:
+                with self.span('restore'):
+                    manager.restore(self.model, latest)
+                    # The snapshot's optimizer state carries the rate of the run that wrote it
+                    self.model.optimizer.learning_rate = learning_rate
+                start_epoch = latest['epoch']
+                print(f"Resumed training from epoch {start_epoch} (step {latest['step']})")
+            elif resume_training and self.load_checkpoint():
+                # Legacy full-model .h5 checkpoints: keep the weights, start a fresh optimizer
+                weights = self.model.get_weights()
+                build()
+                self.model.set_weights(weights)
+                start_epoch = self.get_last_epoch()
+                print(f"Resumed training from existing checkpoint")
+            else:
+                # A fresh run does not compete with the best loss of an earlier one
+                manager.best_loss = None
+                print("Starting training from scratch")
         
         # Save tokenizer and metadata
         self.save_tokenizer_and_metadata()
         
-        # Set up callbacks
-        callbacks = [
-            # Save model every checkpoint_freq epochs
-            ModelCheckpoint(
-                filepath=f"{checkpoint_dir}/model_epoch_{{epoch:03d}}.h5",
-                save_freq=checkpoint_freq * len(X) // 32,  # Assuming batch_size=32
-                save_weights_only=False,
-                verbose=1
-            ),
-            # Save best model based on loss
-            ModelCheckpoint(
-                filepath=f"{checkpoint_dir}/best_model.h5",
-                monitor='loss',
-                save_best_only=True,
-                save_weights_only=False,
-                verbose=1
+        # Set up callbacks, after any passed in by the caller
+        callbacks = list(callbacks or []) + [
+            # Snapshot every checkpoint_freq epochs (or checkpoint_steps steps) and on every
+            # new best loss; files are written in the background, keeping the last keep_last plus best
+            AsyncCheckpoint(
+                manager,
+                every_epochs=checkpoint_freq,
+                every_steps=checkpoint_steps,
+                monitor='loss'
             ),
             # Early stopping to prevent overfitting
             EarlyStopping(
@@ -93,34 +483,60 @@ class SimpleLLM:
                 patience=20,
                 restore_best_weights=True,
                 verbose=1
+            ),
+            # Last, so the epoch's checkpoint hand-off is already counted as blocked time
+            TrainingMetrics(
+                self.run_log,
+                samples_per_epoch=num_samples,
+                tokens_per_epoch=self.tokens_per_epoch,
+                checkpoint_manager=manager,
+                profile_steps=profile_steps,
+                profile_dir=profile_dir or f"{checkpoint_dir}/profile"
             )
         ]
         
         # Train the model
         remaining_epochs = epochs - start_epoch
         if remaining_epochs > 0:
-            history = self.model.fit(
-                X, y, 
-                epochs=remaining_epochs,
-                initial_epoch=start_epoch,
-                callbacks=callbacks,
-                verbose=1
-            )
+            with self.span('fit'):
+                history = self.model.fit(
+                    **train_inputs,
+                    # Keras counts epochs up to this index, starting from initial_epoch
+                    epochs=epochs,
+                    initial_epoch=start_epoch,
+                    callbacks=callbacks,
+                    verbose=1
+                )
+            if segment_length:
+                self.to_window_model()
             
-            # Save final model
-            self.save_final_model()
+            # Save final model, and export the best snapshot for .h5 readers
+            with self.span('save_final'):
+                self.save_final_model()
+                self.export_best_model(manager)
+            self.engine = None
+            self.finish_run_log()
             return history
         else:
             print("Model already trained for requested epochs")
+            if segment_length:
+                self.to_window_model()
+            self.finish_run_log()
             return None
     
+    def finish_run_log(self):
+        """Print the stage summary and close the run log of the current training run"""
+        self.run_log.summary()
+        self.run_log.event('run_end')
+        self.run_log.close()
+        self.run_log = None
+    
     def save_tokenizer_and_metadata(self):
         """Save tokenizer and training metadata"""
         checkpoint_dir = f"checkpoints/{self.model_name}"
         
         # Save tokenizer
-        with open(f"{checkpoint_dir}/tokenizer.pickle", 'wb') as f:
-            pickle.dump(self.tokenizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.tokenizer.save(f"{checkpoint_dir}/tokenizer.npz")
         
         # Save metadata
         metadata = {
@@ -130,39 +546,43 @@ class SimpleLLM:
         with open(f"{checkpoint_dir}/metadata.pickle", 'wb') as f:
             pickle.dump(metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
     
+    def load_tokenizer(self):
+        """Load the saved tokenizer, converting a legacy pickled Keras Tokenizer"""
+        checkpoint_dir = f"checkpoints/{self.model_name}"
+        if os.path.exists(f"{checkpoint_dir}/tokenizer.npz"):
+            self.tokenizer = CompactTokenizer.load(f"{checkpoint_dir}/tokenizer.npz")
+            return True
+        if os.path.exists(f"{checkpoint_dir}/tokenizer.pickle"):
+            with open(f"{checkpoint_dir}/tokenizer.pickle", 'rb') as f:
+                self.tokenizer = CompactTokenizer.from_keras(pickle.load(f))
+            return True
+        return False
+    
     def load_checkpoint(self, epoch=None):
         """Load model from checkpoint"""
         checkpoint_dir = f"checkpoints/{self.model_name}"
         
         try:
             # Load tokenizer and metadata
-            with open(f"{checkpoint_dir}/tokenizer.pickle", 'rb') as f:
-                self.tokenizer = pickle.load(f)
+            if not self.load_tokenizer():
+                raise FileNotFoundError(f"No tokenizer found in {checkpoint_dir}")
             
             with open(f"{checkpoint_dir}/metadata.pickle", 'rb') as f:
                 metadata = pickle.load(f)
                 self.total_words = metadata['total_words']
                 self.max_sequence_length = metadata['max_sequence_length']
             
-            # Load model
-            if epoch is not None:
-                model_path = f"{checkpoint_dir}/model_epoch_{epoch:03d}.h5"
-            else:
-                # Load the best model or most recent
-                if os.path.exists(f"{checkpoint_dir}/best_model.h5"):
-                    model_path = f"{checkpoint_dir}/best_model.h5"
-                elif os.path.exists(f"{checkpoint_dir}/final_model.h5"):
-                    model_path = f"{checkpoint_dir}/final_model.h5"
-                else:
-                    # Find the most recent epoch checkpoint
-                    checkpoints = [f for f in os.listdir(checkpoint_dir) if f.startswith('model_epoch_')]
-                    if checkpoints:
-                        latest = max(checkpoints, key=lambda x: int(x.split('_')[2].split('.')[0]))
-                        model_path = f"{checkpoint_dir}/{latest}"
-                    else:
-                        return False
+            # Snapshots recorded in the manifest take precedence over exported .h5 files
+            entry, model_path = choose_checkpoint(checkpoint_dir, epoch)
+            if entry is not None:
+                self.build_model()
+                CheckpointManager(checkpoint_dir).restore(self.model, entry)
+                print(f"Loaded model from {checkpoint_dir}/{entry['file']}")
+                return True
+            if model_path is None:
+                return False
             
-            self.model = load_model(model_path)
+            self.model = load_model(model_path, custom_objects={'SampledSoftmaxSequential': SampledSoftmaxSequential})
             print(f"Loaded model from {model_path}")
             return True
             
@@ -173,6 +593,9 @@ class SimpleLLM:
     def get_last_epoch(self):
         """Get the epoch number of the last saved checkpoint"""
         checkpoint_dir = f"checkpoints/{self.model_name}"
+        latest = CheckpointManager(checkpoint_dir).latest()
+        if latest is not None:
+            return latest['epoch']
         try:
             checkpoints = [f for f in os.listdir(checkpoint_dir) if f.startswith('model_epoch_')]
             if checkpoints:
@@ -188,26 +611,55 @@ class SimpleLLM:
         self.model.save(f"{checkpoint_dir}/final_model.h5")
         print(f"Final model saved to {checkpoint_dir}/final_model.h5")
     
-    def generate_text(self, seed_text, next_words=15):
+    def export_best_model(self, manager):
+        """Write the best manifest snapshot to best_model.h5"""
+        best = manager.best()
+        if best is None:
+            return
+        checkpoint_dir = f"checkpoints/{self.model_name}"
+        current_weights = self.model.get_weights()
+        self.model.set_weights(manager.load_arrays(best)[0])
+        self.model.save(f"{checkpoint_dir}/best_model.h5")
+        self.model.set_weights(current_weights)
+        print(f"Best model (epoch {best['epoch']}, loss {best['loss']:.4f}) saved to {checkpoint_dir}/best_model.h5")
+    
+    def get_engine(self):
+        """Return a stateful generation engine for the current model"""
+        if self.engine is None or self.engine.source_model is not self.model:
+            self.engine = GenerationEngine(self.model)
+            # Cached states belong to the previous weights
+            if self.prefix_cache is not None:
+                self.prefix_cache.clear()
+        self.engine.prefix_cache = self.prefix_cache
+        return self.engine
+    
+    def enable_prefix_cache(self, max_mb=64, block_size=8):
+        """Reuse LSTM states for prompts sharing a prefix, within a memory budget of max_mb"""
+        self.prefix_cache = PrefixCache(max_bytes=int(max_mb * 2**20), block_size=block_size)
+        return self.prefix_cache
+    
+    def generate_text(self, seed_text, next_words=15, exact=True):
         """Generate text using the trained model"""
         if self.model is None or self.tokenizer is None:
             if not self.load_checkpoint():
                 print("No trained model found. Please train the model first.")
                 return None
         
-        for _ in range(next_words):
-            token_list = self.tokenizer.texts_to_sequences([seed_text])[0]
-            token_list = pad_sequences([token_list], maxlen=self.max_sequence_length-1, padding='pre')
-            predicted_probabilities = self.model.predict(token_list, verbose=0)[0]
-            predicted_index = np.argmax(predicted_probabilities)
-            
-            if predicted_index in self.tokenizer.index_word:
-                output_word = self.tokenizer.index_word[predicted_index]
-                seed_text += " " + output_word
-            else:
-                break
-                
-        return seed_text
+        # exact=False carries the LSTM state instead of re-reading the window: faster, but different text
+        return self.generate_batch([seed_text], next_words=next_words, exact=exact)[0]
+    
+    def generate_batch(self, prompts, next_words=15, temperature=0.0, top_k=None, top_p=None,
+                       num_beams=1, stop_words=None, seed=None, exact=True):
+        """Generate text for many prompts at once, one batched forward pass per word"""
+        if self.model is None or self.tokenizer is None:
+            if not self.load_checkpoint():
+                print("No trained model found. Please train the model first.")
+                return None
+        
+        return generate_texts(
+            self.get_engine(), self.tokenizer, prompts, self.max_sequence_length-1, stop_words=stop_words,
+            next_words=next_words, temperature=temperature, top_k=top_k, top_p=top_p,
+            num_beams=num_beams, seed=seed, exact=exact)
 
 # Example usage
 if __name__ == "__main__":
@@ -246,6 +698,11 @@ if __name__ == "__main__":
     generated = llm.generate_text("Once upon a time", next_words=20)
     print(f"Generated text: {generated}")
     
+    # Generate for many prompts at once with nucleus sampling
+    generated = llm.generate_batch(["Once upon a time", "The parish includes"],
+                                   next_words=20, temperature=0.8, top_p=0.9)
+    print(f"Generated batch: {generated}")
+    
     # To load a specific epoch later:
     # llm.load_checkpoint(epoch=50)
     
@@ -257,6 +714,23 @@ if __name__ == "__main__":
 # llm = SimpleLLM("my_model")
 # llm.train_with_checkpoints(data, epochs=200, checkpoint_freq=10)
 
+# To train on a large corpus without building every padded prefix in memory:
+# llm.train_with_checkpoints(data, epochs=200, streaming=True, window_size=50)
+
+# For long documents, train on contiguous segments with every word a target (truncated BPTT):
+# llm.train_with_checkpoints(data, epochs=50, segment_length=64, batch_size=32)
+
+# For a large vocabulary, train on integer targets with a sampled softmax head:
+# llm.train_with_checkpoints(data, epochs=200, streaming=True, num_sampled=512)
+
+# To train on multi-GB text files, tokenize them into shards once, then stream the shards:
+# from corpus import ingest, ShardedCorpus
+# ingest(["data/*.txt.gz"], "corpora/books")  # or: python corpus.py data/ --output corpora/books
+# llm.train_with_checkpoints(ShardedCorpus("corpora/books"), epochs=20, window_size=50)
+
+# To spread each step over 4 CPU replicas (batch_size is per replica), reproducibly:
+# llm.train_with_checkpoints(data, epochs=200, streaming=True, batch_size=64, data_parallel=4, seed=0)
+
 # To resume interrupted training:
 # llm = SimpleLLM("my_model")  # Same name as before
 # llm.train_with_checkpoints(data, epochs=200)  # Automatically resumes
@@ -0,0 +1,330 @@
+import argparse
+import json
+import os
+import pickle
+import h5py
+import numpy as np
+from checkpoint_manager import CheckpointManager, choose_checkpoint
+from decoding import BatchDecoder, generate_texts
+from prefix_cache import PrefixCache
+from fast_tokenizer import CompactTokenizer
+
+
+class PickledTokenizer:
+    """Stand-in for an unpickled Keras Tokenizer that applies the same text-to-id rules"""
+
+    def texts_to_sequences(self, texts):
+        sequences = []
+        for text in texts:
+            if self.lower:
+                text = text.lower()
+            text = text.translate(str.maketrans({c: self.split for c in self.filters}))
+            words = list(text) if self.char_level else [w for w in text.split(self.split) if w]
+
+            sequence = []
+            oov_index = self.word_index.get(self.oov_token) if self.oov_token is not None else None
+            for word in words:
+                index = self.word_index.get(word)
+                if index is not None and not (self.num_words and index >= self.num_words):
+                    sequence.append(index)
+                elif oov_index is not None:
+                    sequence.append(oov_index)
+            sequences.append(sequence)
+        return sequences
+
+
+class TokenizerUnpickler(pickle.Unpickler):
+    """Loads a legacy tokenizer.pickle without importing Keras"""
+
+    def find_class(self, module, name):
+        if name == 'Tokenizer' and 'preprocessing' in module:
+            return PickledTokenizer
+        return super().find_class(module, name)
+
+
+def load_h5_layers(path):
+    """Read layer configs and weights from a Keras .h5 checkpoint as contiguous float32 arrays"""
+    with h5py.File(path, 'r') as f:
+        model_config = json.loads(f.attrs['model_config'])
+        configs = {layer['config']['name']: layer for layer in model_config['config']['layers']}
+        group = f['model_weights']
+
+        layers = []
+        for name in group.attrs['layer_names']:
+            name = name.decode() if isinstance(name, bytes) else name
+            weight_names = [w.decode() if isinstance(w, bytes) else w for w in group[name].attrs['weight_names']]
+            weights = [np.ascontiguousarray(group[name][w][()], dtype=np.float32) for w in weight_names]
+            layers.append((configs[name]['class_name'], configs[name]['config'], weights))
+    return layers
+
+
+class QuantizedMatrix:
+    """Int8 or float16 weight matrix with per-channel scales, dequantized only where it is used"""
+
+    # Makes ndarray @ QuantizedMatrix defer to __rmatmul__ instead of converting to an array
+    __array_ufunc__ = None
+    # Columns dequantized at a time in a product, bounding the float32 copy to a few hundred KB
+    column_chunk = 1024
+
+    def __init__(self, values, scale=None, row_scaled=False):
+        self.values = values
+        self.scale = scale
+        self.row_scaled = row_scaled
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + (self.scale.nbytes if self.scale is not None else 0)
+
+    def __getitem__(self, index):
+        # Embedding lookups dequantize only the gathered rows
+        rows = self.values[index].astype(np.float32)
+        if self.scale is not None:
+            rows *= self.scale[index][..., None] if self.row_scaled else self.scale
+        return rows
+
+    def dequantize(self):
+        values = self.values.astype(np.float32)
+        if self.scale is not None:
+            values *= self.scale[:, None] if self.row_scaled else self.scale
+        return values
+
+    def __rmatmul__(self, x):
+        result = np.empty(x.shape[:-1] + self.values.shape[1:], dtype=np.float32)
+        for start in range(0, self.values.shape[1], self.column_chunk):
+            columns = slice(start, start + self.column_chunk)
+            # Column scales factor out of the product: x @ (q * s) == (x @ q) * s
+            result[..., columns] = x @ self.values[:, columns].astype(np.float32)
+            if self.scale is not None:
+                result[..., columns] *= self.scale[columns]
+        return result
+
+
+def load_snapshot_layers(manager, entry, reference_path=None):
+    """Read a manifest snapshot with the layer configs recorded in its manifest entry"""
+    weights = iter(np.ascontiguousarray(w, dtype=np.float32) for w in manager.load_arrays(entry)[0])
+    if 'layers' in entry:
+        return [(class_name, config, [next(weights) for _ in range(count)])
+                for class_name, config, count in entry['layers']]
+    # Older entries have no configs; an exported .h5 of the same architecture supplies them
+    return [(class_name, config, [next(weights) for _ in reference])
+            for class_name, config, reference in load_h5_layers(reference_path)]
+
+
+def load_quantized_layers(path):
+    """Read layers written by quantize.py, keeping the weights in their compact dtype"""
+    with np.load(path, allow_pickle=False) as artifact:
+        layers = []
+        for i, (class_name, config, names) in enumerate(json.loads(str(artifact['layers']))):
+            weights = []
+            for name in names:
+                values = artifact[f"{i}/{name}"]
+                if f"{i}/{name}/scale" in artifact:
+                    weights.append(QuantizedMatrix(values, artifact[f"{i}/{name}/scale"], row_scaled=class_name == 'Embedding'))
+                elif values.dtype == np.float16:
+                    weights.append(QuantizedMatrix(values))
+                else:
+                    weights.append(np.ascontiguousarray(values, dtype=np.float32))
+            layers.append((class_name, config, weights))
+    return layers
+
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def softmax(x):
+    x = np.exp(x - x.max(axis=-1, keepdims=True))
+    return x / x.sum(axis=-1, keepdims=True)
+
+
+class NumpyEngine(BatchDecoder):
+    """Embedding -> LSTM... -> Dense forward pass in NumPy, matching the stateful GenerationEngine"""
+
+    def __init__(self, layers, dequantize_bytes=0):
+        self.lstms = []
+        for class_name, config, weights in layers:
+            if class_name == 'Embedding':
+                self.embeddings = weights[0]
+            elif class_name == 'LSTM':
+                if config.get('activation', 'tanh') != 'tanh' or config.get('recurrent_activation', 'sigmoid') != 'sigmoid':
+                    raise ValueError(f"Unsupported LSTM activations in layer {config['name']}")
+                # LSTM kernels are small and used at every timestep, so they are expanded once;
+                # only the embedding and the vocabulary-sized head stay compact
+                kernel, recurrent_kernel, bias = [w.dequantize() if isinstance(w, QuantizedMatrix) else w
+                                                  for w in weights]
+                self.lstms.append((kernel, recurrent_kernel, bias))
+            elif class_name == 'Dense':
+                kernel, self.dense_bias = weights
+                # float16 is a storage format only (NumPy converts it slowly), so that head is expanded
+                # once; an int8 head is expanded too when its float32 copy fits dequantize_bytes
+                if isinstance(kernel, QuantizedMatrix) and (kernel.scale is None or 4 * kernel.values.size <= dequantize_bytes):
+                    kernel = kernel.dequantize()
+                self.dense_kernel = kernel
+            elif weights:
+                raise ValueError(f"Unsupported layer {class_name} in checkpoint")
+        self.total_words = self.embeddings.shape[0]
+        self.state_units = [units for _, recurrent_kernel, _ in self.lstms
+                            for units in (recurrent_kernel.shape[0],) * 2]
+
+    def initial_state(self, batch_size=1):
+        """Zero hidden and cell states for every LSTM layer"""
+        return [np.zeros((batch_size, units), dtype=np.float32) for units in self.state_units]
+
+    def encode(self, token_ids, states=None):
+        """Run a (batch, length) block of token ids and return next-token probabilities and states"""
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        if states is None:
+            states = self.initial_state(len(token_ids))
+
+        x = self.embeddings[token_ids]
+        new_states = []
+        for i, (kernel, recurrent_kernel, bias) in enumerate(self.lstms):
+            h, c = states[2 * i], states[2 * i + 1]
+            units = recurrent_kernel.shape[0]
+            # Input projections for every timestep in one matmul; only the recurrence is sequential
+            projected = x @ kernel + bias
+            outputs = np.empty(projected.shape[:2] + (units,), dtype=np.float32)
+            for t in range(projected.shape[1]):
+                z = projected[:, t] + h @ recurrent_kernel
+                gate_i = sigmoid(z[:, :units])
+                gate_f = sigmoid(z[:, units:2 * units])
+                gate_o = sigmoid(z[:, 3 * units:])
+                c = gate_f * c + gate_i * np.tanh(z[:, 2 * units:3 * units])
+                h = gate_o * np.tanh(c)
+                outputs[:, t] = h
+            new_states += [h, c]
+            x = outputs
+
+        probabilities = softmax(x[:, -1] @ self.dense_kernel + self.dense_bias)
+        return probabilities, new_states
+
+    def step(self, token_ids, states):
+        """Feed one token per sequence, costing a single LSTM step regardless of context length"""
+        return self.encode(np.asarray(token_ids, dtype=np.int64)[:, None], states)
+
+
+class NumpyLLM:
+    """Inference-only SimpleLLM that runs checkpointed weights without importing TensorFlow"""
+
+    def __init__(self, model_name="simple_llm"):
+        self.model_name = model_name
+        self.engine = None
+        self.model_path = None
+        # Layer configs and weights behind the engine, as read from model_path
+        self.layers = None
+        self.tokenizer = None
+        self.max_sequence_length = None
+        self.total_words = None
+        self.prefix_cache = None
+
+    def enable_prefix_cache(self, max_mb=64, block_size=8):
+        """Reuse LSTM states for prompts sharing a prefix, within a memory budget of max_mb"""
+        self.prefix_cache = PrefixCache(max_bytes=int(max_mb * 2**20), block_size=block_size)
+        return self.prefix_cache
+
+    def load_checkpoint(self, epoch=None, quantized=None, dequantize_mb=0):
+        """Load tokenizer, metadata and weights, choosing the checkpoint like SimpleLLM.load_checkpoint
+
+        With quantized="int8" the output head stays int8 and is expanded per word, unless its
+        float32 copy fits in dequantize_mb.
+        """
+        checkpoint_dir = f"checkpoints/{self.model_name}"
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+
+        try:
+            if os.path.exists(f"{checkpoint_dir}/tokenizer.npz"):
+                self.tokenizer = CompactTokenizer.load(f"{checkpoint_dir}/tokenizer.npz")
+            else:
+                with open(f"{checkpoint_dir}/tokenizer.pickle", 'rb') as f:
+                    self.tokenizer = TokenizerUnpickler(f).load()
+
+            with open(f"{checkpoint_dir}/metadata.pickle", 'rb') as f:
+                metadata = pickle.load(f)
+                self.total_words = metadata['total_words']
+                self.max_sequence_length = metadata['max_sequence_length']
+
+            if quantized is not None:
+                # Compact artifact written by quantize.py, e.g. quantized="int8"
+                model_path = f"{checkpoint_dir}/model_{quantized}.npz"
+                self.layers = load_quantized_layers(model_path)
+                self.engine = NumpyEngine(self.layers, dequantize_bytes=int(dequantize_mb * 2**20))
+                self.model_path = model_path
+                print(f"Loaded model from {model_path}")
+                return True
+
+            # Same choice as SimpleLLM.load_checkpoint
+            entry, model_path = choose_checkpoint(checkpoint_dir, epoch)
+            if entry is not None:
+                reference = next((f"{checkpoint_dir}/{name}" for name in ("final_model.h5", "best_model.h5")
+                                  if os.path.exists(f"{checkpoint_dir}/{name}")), None)
+                if 'layers' not in entry and reference is None:
+                    raise FileNotFoundError(f"No exported .h5 in {checkpoint_dir} to read the layer configs of "
+                                            f"{entry['file']} from")
+                model_path = f"{checkpoint_dir}/{entry['file']}"
+                self.layers = load_snapshot_layers(CheckpointManager(checkpoint_dir), entry, reference)
+            elif model_path is None:
+                return False
+            else:
+                self.layers = load_h5_layers(model_path)
+            self.engine = NumpyEngine(self.layers)
+            self.model_path = model_path
+            print(f"Loaded model from {model_path}")
+            return True
+
+        except (FileNotFoundError, EOFError) as e:
+            print(f"Could not load checkpoint: {e}")
+            return False
+
+    def generate_text(self, seed_text, next_words=15, exact=True):
+        """Generate text using the checkpointed weights"""
+        generated = self.generate_batch([seed_text], next_words=next_words, exact=exact)
+        return generated[0] if generated else None
+
+    def generate_batch(self, prompts, next_words=15, temperature=0.0, top_k=None, top_p=None,
+                       num_beams=1, stop_words=None, seed=None, exact=True):
+        """Generate text for many prompts at once, one batched NumPy forward pass per word"""
+        if self.engine is None and not self.load_checkpoint():
+            print("No trained model found. Please train the model first.")
+            return None
+
+        self.engine.prefix_cache = self.prefix_cache
+        return generate_texts(
+            self.engine, self.tokenizer, prompts, self.max_sequence_length-1, stop_words=stop_words,
+            next_words=next_words, temperature=temperature, top_k=top_k, top_p=top_p,
+            num_beams=num_beams, seed=seed, exact=exact)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate text from a SimpleLLM checkpoint without TensorFlow")
+    parser.add_argument("prompt", nargs="+")
+    parser.add_argument("--model-name", default="fairy_tale_model")
+    parser.add_argument("--epoch", type=int, default=None)
+    parser.add_argument("--next-words", type=int, default=15)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument("--top-p", type=float, default=None)
+    parser.add_argument("--num-beams", type=int, default=1)
+    parser.add_argument("--stateful", action="store_true",
+                        help="Carry the LSTM state instead of re-reading the window: faster, but changes the text")
+    parser.add_argument("--quantized", choices=["int8", "float16"], default=None,
+                        help="Run the artifact written by quantize.py instead of the .h5 weights")
+    parser.add_argument("--dequantize-mb", type=float, default=0,
+                        help="Expand an int8 output head to float32 at load when it fits, for float32 speed")
+    args = parser.parse_args()
+
+    llm = NumpyLLM(args.model_name)
+    if not llm.load_checkpoint(epoch=args.epoch, quantized=args.quantized, dequantize_mb=args.dequantize_mb):
+        raise SystemExit(f"No checkpoint found for {args.model_name}")
+    for text in llm.generate_batch(args.prompt, next_words=args.next_words, temperature=args.temperature,
+                                   top_k=args.top_k, top_p=args.top_p, num_beams=args.num_beams,
+                                   exact=not args.stateful):
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
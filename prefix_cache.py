@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class PrefixCache:
+    """LRU cache of the LSTM states reached after token-id prefixes of padded prompts
+
+    States are kept every block_size tokens and at the end of each prompt, where the
+    next-token probabilities are kept too. Lookups only happen at those boundaries, so
+    the flat dict acts as a trie with block_size-token edges. A prompt resumes from its
+    longest cached prefix and only the remaining blocks are encoded, once per distinct
+    prefix in the batch.
+
+    Keys include the pre-padding, whose zeros the LSTMs also read, so prompts only
+    share states when their token counts are equal. The stats count prompt tokens only:
+    reusing nothing but padding is a miss.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, block_size=8):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        # Prefix bytes -> (states, probabilities or None), least recently used first
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'partial_hits': 0, 'misses': 0,
+                      'reused_tokens': 0, 'encoded_tokens': 0, 'evictions': 0}
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def usage(self):
+        return dict(self.stats, entries=len(self.entries), bytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def _get(self, prefix):
+        key = prefix.tobytes()
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def _put(self, prefix, states, probabilities=None):
+        key = prefix.tobytes()
+        if key in self.entries:
+            self.nbytes -= entry_bytes(self.entries.pop(key))
+        entry = (states, probabilities)
+        size = entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= entry_bytes(evicted)
+            self.stats['evictions'] += 1
+
+    def encode(self, engine, token_ids):
+        """engine.encode for a (batch, length) block of prompts, reusing cached prefix states"""
+        token_ids = np.asarray(token_ids, dtype=np.int32)
+        batch_size, length = token_ids.shape
+        boundaries = list(range(self.block_size, length, self.block_size)) + [length]
+        states = engine.initial_state(batch_size)
+        probabilities = [None] * batch_size
+        starts = np.zeros(batch_size, dtype=np.int64)
+
+        for row in range(batch_size):
+            for end in reversed(boundaries):
+                entry = self._get(token_ids[row, :end])
+                # A full hit needs the probabilities; a bare state at this length was left by a longer prompt
+                if entry is None or (end == length and entry[1] is None):
+                    continue
+                for state, cached in zip(states, entry[0]):
+                    state[row] = cached
+                starts[row] = end
+                probabilities[row] = entry[1] if end == length else None
+                break
+        # Positions whose states came from the cache or from another row of this batch
+        reused = np.arange(length) < starts[:, None]
+
+        # Walk the blocks in order; rows resuming at the same boundary are encoded together,
+        # and rows of this batch with the same prefix up to the block end share one encode
+        start = 0
+        for end in boundaries:
+            rows = np.flatnonzero(starts == start)
+            if len(rows):
+                _, first, group = np.unique(token_ids[rows, :end], axis=0, return_index=True, return_inverse=True)
+                group = group.reshape(-1)
+                block_probabilities, block_states = engine.encode(token_ids[rows[first], start:end],
+                                                                  [state[rows[first]] for state in states])
+                for state, block_state in zip(states, block_states):
+                    state[rows] = block_state[group]
+                for i, row in enumerate(rows[first]):
+                    row_probabilities = block_probabilities[i].copy() if end == length else None
+                    self._put(token_ids[row, :end], [state[i].copy() for state in block_states], row_probabilities)
+                if end == length:
+                    for i, row in enumerate(rows):
+                        probabilities[row] = block_probabilities[group[i]].copy()
+                shared = np.ones(len(rows), dtype=bool)
+                shared[first] = False
+                reused[rows[shared], start:end] = True
+                starts[rows] = end
+            start = end
+
+        # Shared padding saves work but says nothing about prompt reuse, so only real tokens count
+        real = token_ids != 0
+        for row in range(batch_size):
+            reused_tokens = int((reused[row] & real[row]).sum())
+            outcome = 'hits' if reused[row].all() else 'partial_hits' if reused_tokens else 'misses'
+            self.stats[outcome] += 1
+            self.stats['reused_tokens'] += reused_tokens
+            self.stats['encoded_tokens'] += int(real[row].sum()) - reused_tokens
+
+        return np.stack(probabilities), states
+
+
+def entry_bytes(entry):
+    states, probabilities = entry
+    return sum(state.nbytes for state in states) + (probabilities.nbytes if probabilities is not None else 0)
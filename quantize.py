@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import numpy as np
+from decoding import pad_pre
+from numpy_runtime import NumpyLLM, NumpyEngine, QuantizedMatrix
+
+
+# Weight names in the order each layer stores them in the .h5 checkpoints
+WEIGHT_NAMES = {
+    'Embedding': ['embeddings'],
+    'LSTM': ['kernel', 'recurrent_kernel', 'bias'],
+    'Dense': ['kernel', 'bias'],
+}
+
+
+def quantize_matrix(weights, dtype='int8', axis=0):
+    """Symmetric per-channel quantization; axis is reduced, so every other index gets its own scale"""
+    if dtype == 'float16':
+        return QuantizedMatrix(weights.astype(np.float16))
+    scale = np.abs(weights).max(axis=axis) / 127.0
+    scale[scale == 0] = 1.0
+    values = np.round(weights / np.expand_dims(scale, axis)).astype(np.int8)
+    return QuantizedMatrix(values, scale.astype(np.float32), row_scaled=axis == 1)
+
+
+def quantize_layers(layers, dtype='int8'):
+    """Quantize embedding rows and kernel columns; biases stay float32"""
+    quantized = []
+    for class_name, config, weights in layers:
+        compact = []
+        for name, weight in zip(WEIGHT_NAMES.get(class_name, []), weights):
+            if name == 'embeddings':
+                compact.append(quantize_matrix(weight, dtype, axis=1))
+            elif weight.ndim == 2:
+                compact.append(quantize_matrix(weight, dtype, axis=0))
+            else:
+                compact.append(weight)
+        quantized.append((class_name, config, compact))
+    return quantized
+
+
+def save_quantized_layers(layers, path):
+    """Write quantized layers as one .npz artifact readable by numpy_runtime.load_quantized_layers"""
+    arrays = {}
+    description = []
+    for i, (class_name, config, weights) in enumerate(layers):
+        names = WEIGHT_NAMES.get(class_name, [])[:len(weights)]
+        description.append((class_name, config, names))
+        for name, weight in zip(names, weights):
+            if isinstance(weight, QuantizedMatrix):
+                arrays[f"{i}/{name}"] = weight.values
+                if weight.scale is not None:
+                    arrays[f"{i}/{name}/scale"] = weight.scale
+            else:
+                arrays[f"{i}/{name}"] = weight
+    arrays['layers'] = np.array(json.dumps(description))
+    np.savez(path, **arrays)
+
+
+def weight_bytes(layers):
+    return sum(weight.nbytes for _, _, weights in layers for weight in weights)
+
+
+def perplexity(engine, sequences, window, batch_size=256):
+    """Next-word perplexity over every prefix of the held-out lines, windowed exactly as in training"""
+    contexts, targets = [], []
+    for sequence in sequences:
+        for i in range(1, len(sequence)):
+            contexts.append(sequence[:i])
+            targets.append(sequence[i])
+    if not targets:
+        raise ValueError("No held-out sequences with at least two known words")
+
+    log_likelihood = 0.0
+    for start in range(0, len(targets), batch_size):
+        token_ids = pad_pre(contexts[start:start + batch_size], window)
+        probabilities, _ = engine.encode(token_ids)
+        chosen = probabilities[np.arange(len(token_ids)), targets[start:start + batch_size]]
+        log_likelihood += np.log(np.maximum(chosen, 1e-12)).sum()
+    return float(np.exp(-log_likelihood / len(targets)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a SimpleLLM checkpoint with int8 or float16 weights")
+    parser.add_argument("--model-name", default="fairy_tale_model")
+    parser.add_argument("--epoch", type=int, default=None)
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    parser.add_argument("--heldout", default=None, help="Text file, one sample per line, for the perplexity check")
+    args = parser.parse_args()
+
+    llm = NumpyLLM(args.model_name)
+    if not llm.load_checkpoint(epoch=args.epoch):
+        raise SystemExit(f"No checkpoint found for {args.model_name}")
+
+    # Float32 layers as loaded, from an .h5 export or a manifest snapshot
+    source = llm.model_path
+    layers = llm.layers
+    quantized = quantize_layers(layers, args.dtype)
+    output = f"{os.path.dirname(source)}/model_{args.dtype}.npz"
+    save_quantized_layers(quantized, output)
+
+    print(f"Checkpoint: {source} ({os.path.getsize(source) / 1024:.1f} KB on disk, "
+          f"{weight_bytes(layers) / 1024:.1f} KB of weights)")
+    print(f"Quantized:  {output} ({os.path.getsize(output) / 1024:.1f} KB on disk, "
+          f"{weight_bytes(quantized) / 1024:.1f} KB of weights)")
+    if args.dtype == 'int8':
+        print("int8 trades speed for memory: the output head is expanded per word, so decoding is slower "
+              "than float32 unless numpy_runtime.py --dequantize-mb expands it once at load")
+    else:
+        print("float16 is a storage format: numpy_runtime.py expands the output head to float32 at load, "
+              "so only the file and the embedding stay smaller")
+
+    if args.heldout:
+        with open(args.heldout, encoding='utf-8') as f:
+            sequences = llm.tokenizer.texts_to_sequences([line for line in f if line.strip()])
+        window = llm.max_sequence_length - 1
+        float_ppl = perplexity(NumpyEngine(layers), sequences, window)
+        quantized_ppl = perplexity(NumpyEngine(quantized), sequences, window)
+        print(f"Perplexity: float32 {float_ppl:.3f}, {args.dtype} {quantized_ppl:.3f} "
+              f"(delta {quantized_ppl - float_ppl:+.3f}, {100 * (quantized_ppl / float_ppl - 1):+.2f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -86,15 +86,19 @@ tokenizer = Tokenizer()
 tokenizer.fit_on_texts(data)
 total_words = len(tokenizer.word_index) + 1
 
-input_sequences = []
-for line in data:
-    token_list = tokenizer.texts_to_sequences([line])[0]
-    for i in range(0, len(token_list)):
-        n_gram_sequence = token_list[:i+1]
-        input_sequences.append(n_gram_sequence)
+# Fixed-size context windows over the token stream, built lazily per batch
+# instead of materialising every padded prefix of the article
+window_size = 50
+batch_size = 32
+token_list = np.concatenate([tokenizer.texts_to_sequences([line])[0] for line in data]).astype('int32')
+padded_tokens = np.concatenate([np.zeros(window_size, dtype='int32'), token_list])
+max_sequence_length = window_size + 1
 
-max_sequence_length = max([len(x) for x in input_sequences])
-input_sequences = pad_sequences(input_sequences, maxlen=max_sequence_length, padding='pre')
+dataset = tf.keras.utils.timeseries_dataset_from_array(
+    padded_tokens, token_list, sequence_length=window_size,
+    batch_size=batch_size, shuffle=True)
+dataset = dataset.map(lambda X, y: (X, tf.one_hot(y, total_words)), num_parallel_calls=tf.data.AUTOTUNE)
+dataset = dataset.prefetch(tf.data.AUTOTUNE)
 
 
 print("---MODELLING---")
@@ -108,10 +112,7 @@ model.add(Dense(total_words, activation='softmax'))
 
 model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
 
-X, y = input_sequences[:, :-1], input_sequences[:, -1]
-y = tf.keras.utils.to_categorical(y, num_classes=total_words)
-
-model.fit(X, y, epochs=200, verbose=1)
+model.fit(dataset, epochs=200, verbose=1)
 
 
 